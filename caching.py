@@ -23,6 +23,9 @@ class Stats:
     diskHits= 0
     misses= 0
 
+tlgmetrics.Counter('tlg_file_cache_lookups_total', 'Lookups in the file based cache, by result.', ('result',),
+    function= lambda: { ('memhit',): Stats.memHits, ('diskhit',): Stats.diskHits, ('miss',): Stats.misses })
+
 # base class for cache entries
 # cache entries are implemented as context managers, to be used with the "with" statement, see __main__ chunk below.
 class FileBasedCache:
@@ -42,6 +45,17 @@ class FileBasedCache:
     def getSubdir(identifier):
         return FileBasedCache.cacheDir + '/%02x' % (FileBasedCache.getSubdirNum(identifier))
 
+    cacheDirsReady= False
+    cacheDirsLock= threading.Lock()
+    
+    ## create the cache dirs when the first entry is used, and start removing old entries in the background.
+    @staticmethod
+    def ensureCacheDirs():
+        with FileBasedCache.cacheDirsLock:
+            if not FileBasedCache.cacheDirsReady:
+                FileBasedCache.initCacheDirs()
+                FileBasedCache.cacheDirsReady= True
+    
     @staticmethod
     def initCacheDirs():
         # if the cache dir is not accessible, try to create it
@@ -60,7 +74,7 @@ class FileBasedCache:
             except OSError:
                 os.mkdir(subdir)
         
-        FileBasedCache.cleanupCache()
+        runInBackground(FileBasedCache.cleanupCache, 60*60)
     
         
     @staticmethod
@@ -90,6 +104,7 @@ class FileBasedCache:
     
     def __enter__(self):
         # todo: check for identifier-DATE.cache.tmp and wait some time if it exists.
+        FileBasedCache.ensureCacheDirs()
 
         subdir= self.getSubdir(self.identifier)
         basename= subdir + '/' + self.identifier
@@ -99,7 +114,7 @@ class FileBasedCache:
         now= MakeTimestamp(time.time())
         while len(globbed) and not self.isHit(globbed[0], now):
             fn= subdir + '/' + globbed.pop(0)
-            dprint(3, 'removing %s' % fn)
+            dprint(3, 'removing %s', fn)
             os.unlink(fn)
         if len(globbed):
             self.filename= subdir + '/' + globbed.pop()
@@ -113,12 +128,12 @@ class FileBasedCache:
             assert(stat.S_ISREG(fstat.st_mode))
             self.file= open(self.filename, 'r')
             self.hit= True
-            dprint(3, "hit %s!" % self.filename)
+            dprint(3, "hit %s!", self.filename)
             Stats.diskHits+= 1
         except OSError:
             # append suffix so other instances won't read the file while we are writing it
             self.file= open(self.filename + FileBasedCache.tmpSuffix, 'w')
-            dprint(3, "miss %s!" % self.filename)
+            dprint(3, "miss %s!", self.filename)
             Stats.misses+= 1
         
         return self
@@ -167,7 +182,7 @@ class DictCache(FileBasedCache):
     def __setitem__(self, key, value):
         self.values[key]= value
         if self.hit == False: 
-            dprint(3, "writing %s => %s" % (key, value))
+            dprint(3, "writing %s => %s", key, value)
             self.write(json.dumps([key, value]) + "\n")
 
 # list-style iterable cache entry
@@ -444,11 +459,6 @@ class PageIDFakeCache:
 PageIDCache= PageIDMemCache
 
 
-# initialization
-if threading.currentThread().name == 'MainThread':
-    FileBasedCache.initCacheDirs()
-
-
 if __name__ == '__main__':
     with PageIDCache('dewiki_p', getCategoryID('dewiki_p', 'Biologie')) as page:
         print 'cache entry for "Biologie":\n\t', page.values
@@ -35,9 +35,8 @@ class FAFT(FlawFilter):
                     afrrByID[row['arr_page_id']]= row
             
             if len(pageIDs):
-                format_strings = ','.join(['%s'] * len(pageIDs))
-                cur.execute('SELECT * FROM page WHERE page_id IN (%s) AND page_namespace=0' % format_strings, pageIDs)
-                for row in cur.fetchall():
+                for row in self.getPageRows(pageIDs).itervalues():
+                    if row['page_namespace']!=NS_MAIN: continue
                     #~ row['page_title']= "%s/%s" % ("Spezial:Artikelrückmeldungen_v5", row['page_title'])
                     #~ row['page_title']= self.parent.feedbackPageForTitle(row['page_title'])
                     afrr= afrrByID[row['page_id']]
@@ -30,6 +30,7 @@ class FChangeDetector(FlawFilter):
                     cur.execute('SELECT page_id,identifier FROM noticed_article WHERE page_id IN (%s) AND language = %%s AND day = %%s AND detected_by_cta=0 AND detected_by_cts=0 AND detected_by_mdf=0' % format_strings, params)
                     unchanged= cur.fetchall()
                     if len(unchanged):
+                        pages= self.getPageRows([ row['page_id'] for row in unchanged ])
                         # for each unchanged page, check whether the page was changed in other languages on that day.
                         for row in unchanged:
                             #~ dprint(1, 'unchanged: %s' % str(row))
@@ -43,7 +44,8 @@ class FChangeDetector(FlawFilter):
                                 for s in map(lambda x: x['language'], res):
                                     info+= ' '
                                     info+= s
-                                resultQueue.put(TlgResult(self.wiki, getPageByID(self.wiki, row['page_id'])[0], self.parent, infotext= 'changed in: %s' % info))
+                                if row['page_id'] in pages:
+                                    resultQueue.put(TlgResult(self.wiki, pages[row['page_id']], self.parent, infotext= 'changed in: %s' % info))
             except Exception as ex:
                 dprint(0, "ChangeDetector filter exception: %s" % str(ex))
     def getPreferredPagesPerAction(self):
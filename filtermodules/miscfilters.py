@@ -8,20 +8,16 @@ class FAll(FlawFilter):
     shortname= 'ALL'
     label= _('All Pages')
     description= _('Show all articles without filtering.')
+    cacheVerdicts= True
     
     # our action class
     class Action(TlgAction):
         def execute(self, resultQueue):
-            cur= getCursors()[self.wiki]
-            #~ format_strings = ','.join(['%s'] * len(self.pageIDs))
-            #~ cur.execute('SELECT * FROM page WHERE page_id IN (%s)' % format_strings, self.pageIDs)
-            format_strings = ' OR '.join(['page_id=%s'] * len(self.pageIDs))
-            cur.execute("""SELECT page_id, page_namespace, page_title, page_restrictions, page_counter, page_is_redirect, 
-page_is_new, page_random, page_touched, page_latest, page_len 
-FROM page WHERE (page_namespace=0 OR page_namespace=6) AND page_is_redirect=0 AND (%s)""" % format_strings, self.pageIDs)
-            result= cur.fetchall()
-            for row in result:
-                resultQueue.put(TlgResult(self.wiki, row, self.parent))
+            rows= self.getPageRows(self.pageIDs)
+            for pageID in self.pageIDs:
+                row= rows.get(pageID)
+                if row!=None and row['page_namespace'] in (NS_MAIN, NS_FILE) and row['page_is_redirect']==0:
+                    resultQueue.put(TlgResult(self.wiki, row, self.parent))
     
     def getPreferredPagesPerAction(self):
         return 500
@@ -36,18 +32,16 @@ class FAllCategories(FlawFilter):
     shortname= 'Cat_All'
     label= _('All Categories')
     description= _('Show all categories without filtering.')
+    cacheVerdicts= True
     
     # our action class
     class Action(TlgAction):
         def execute(self, resultQueue):
-            cur= getCursors()[self.wiki]
-            format_strings = ' OR '.join(['page_id=%s'] * len(self.pageIDs))
-            cur.execute("""SELECT page_id, page_namespace, page_title, page_restrictions, page_counter, page_is_redirect, 
-page_is_new, page_random, page_touched, page_latest, page_len 
-FROM page WHERE page_namespace=14 AND page_is_redirect=0 AND (%s)""" % format_strings, self.pageIDs)
-            result= cur.fetchall()
-            for row in result:
-                resultQueue.put(TlgResult(self.wiki, row, self.parent))
+            rows= self.getPageRows(self.pageIDs)
+            for pageID in self.pageIDs:
+                row= rows.get(pageID)
+                if row!=None and row['page_namespace']==NS_CATEGORY and row['page_is_redirect']==0:
+                    resultQueue.put(TlgResult(self.wiki, row, self.parent))
     
     def getPreferredPagesPerAction(self):
         return 500
@@ -60,44 +54,148 @@ FlawFilters.register(FAllCategories)
 ##  base class for filters which check for lists of templates.
 # todo: add entries for more languages (?)
 class FTemplatesBase(FlawFilter):
-    def __init__(self, tlg, templateNames):
+    def __init__(self, tlg, templateNames, categoryNames= {}):
         FlawFilter.__init__(self, tlg)
         self.templateNamesForWikis= templateNames
+        self.categoryNamesForWikis= categoryNames
+        self.categoryMembers= None      # set of page IDs in the maintenance categories
+        self.categoriesMissing= False   # True if a maintenance category could not be found
+        self.categoryLock= threading.Lock()
         #~ for wikidb in templateNames:
             #~ for template in templateNames[wikidb]:
                 #~ dprint(0, "%s %s: %s" % (wikidb, template, getCategoryID(wikidb, 'Wikipedia:'+template)))
     
-    class Action(TlgAction):
+    # templates are set on the page itself
+    cacheVerdicts= True
+    
+    # if True, template names are matched by the database, which returns the page rows of matching pages only.
+    # otherwise all templatelinks rows of the tested pages are fetched and matched here.
+    matchInSQL= True
+    
+    # if True, pages are looked up in the maintenance categories corresponding to the templates instead of templatelinks, 
+    # for the wikis which have categoryNames (see useCategories()). pages without the template can be in the categories 
+    # and vice versa, so the results may differ.
+    matchInCategories= False
+    
+    # number of pages tested with one templatelinks query
+    pagesPerQuery= 200
+    
+    class Action(AsyncTlgAction):
         def execute(self, resultQueue):
+            if not self.wiki in self.parent.templateNamesForWikis:
+                # we have no template names for this language version.
+                return
+            if self.parent.matchInSQL:
+                AsyncTlgAction.execute(self, resultQueue)
+            else:
+                self.executeMatchHere(resultQueue, self.parent.templateNamesForWikis[self.wiki])
+        
+        def isAsync(self):
+            return self.parent.matchInSQL and self.wiki in self.parent.templateNamesForWikis
+        
+        # matches the template names in SQL.
+        def executeAsync(self, resultQueue):
+            templateNames= self.parent.templateNamesForWikis[self.wiki]
+            format_strings= ','.join(['%s'] * len(self.pageIDs))
+            name_strings= ','.join(['%s'] * len(templateNames))
+            params= list(self.pageIDs)
+            params.append(NS_TEMPLATE)
+            params.extend(templateNames)
+            rows= yield self.query("""SELECT DISTINCT %s FROM templatelinks JOIN page ON page_id=tl_from 
+                WHERE tl_from IN (%s) AND tl_namespace=%%s AND tl_title IN (%s)""" % (', '.join(pageColumns), format_strings, name_strings), params)
+            self.parent.tlg.pageTable.addRows(rows)
+            for row in rows:
+                resultQueue.put(TlgResult(self.wiki, row, self.parent))
+        
+        def executeMatchHere(self, resultQueue, templateNames):
             cur= getCursors()[self.wiki]
             format_strings = ','.join(['%s'] * len(self.pageIDs))
-            cur.execute('SELECT tl_title, tl_from FROM templatelinks WHERE tl_from IN (%s)' % format_strings, self.pageIDs)
+            params= list(self.pageIDs)
+            params.append(NS_TEMPLATE)
+            cur.execute('SELECT tl_title, tl_from FROM templatelinks WHERE tl_from IN (%s) AND tl_namespace=%%s' % format_strings, params)
             sqlres= cur.fetchall()
-
-            # todo: put this into the sql query.
+            found= set()
             for templatelink in sqlres:
-                tl_title= templatelink['tl_title']
+                if templatelink['tl_title'] in templateNames:
+                    found.add(templatelink['tl_from'])
+            rows= self.getPageRows(found)
+            for pageID in found:
+                if pageID in rows:
+                    resultQueue.put(TlgResult(self.wiki, rows[pageID], self.parent))
+
+    # finds pages in the maintenance categories corresponding to the templates, 
+    # falls back to checking templatelinks if the categories can't be found.
+    class CategoryAction(TlgAction):
+        def execute(self, resultQueue):
+            members= self.parent.getCategoryMembers(self.wiki)
+            if members==None:
+                # category actions have more pages than a templatelinks query should have
+                for pageIDs in chunks(self.pageIDs, self.parent.pagesPerQuery):
+                    self.parent.Action(self.parent, self.language, pageIDs).execute(resultQueue)
+                return
+            found= [ pageID for pageID in self.pageIDs if pageID in members ]
+            rows= self.getPageRows(found)
+            for pageID in found:
+                if pageID in rows:
+                    resultQueue.put(TlgResult(self.wiki, rows[pageID], self.parent))
+    
+    # recursion depth for the maintenance categories. 1 means direct members only.
+    categoryDepth= 1
+    
+    ## true if pages are looked up in maintenance categories instead of templatelinks.
+    # this needs matchInCategories and a category graph which contains the articles, see TaskListGenerator.cg_noleaves.
+    def useCategories(self, wiki):
+        return self.matchInCategories and wiki in self.categoryNamesForWikis and self.tlg.cg!=None and not self.tlg.cg_noleaves
+    
+    ## the verdicts found in the maintenance categories are kept apart from those found in templatelinks.
+    def getVerdictCacheName(self, wiki):
+        if self.useCategories(wiki) and not self.categoriesMissing:
+            return self.shortname + ':categories'
+        return self.shortname
+    
+    ## get the set of pages in the maintenance categories. the categories are only traversed once per query.
+    # returns None if a category could not be found.
+    # the traversals use their own graphserv connection, other filters may use tlg.cg at the same time.
+    def getCategoryMembers(self, wiki):
+        try:
+            self.categoryLock.acquire()
+            if self.categoryMembers==None and not self.categoriesMissing:
+                members= set()
+                cg= self.tlg.cg.clone()
                 try:
-                    if tl_title in self.parent.templateNamesForWikis[self.wiki]:
-                        rows= getPageByID(self.wiki, templatelink['tl_from'])
-                        if len(rows):
-                            resultQueue.put(TlgResult(self.wiki, rows[0], self.parent))
-                except KeyError:
-                    # we have no template names for this language version.
-                    pass
+                    for category in self.categoryNamesForWikis[wiki]:
+                        try:
+                            members.update(cg.getPagesInCategory(category, self.categoryDepth))
+                        except InputValidationError as e:
+                            dprint(0, "%s: %s, checking templatelinks instead" % (self.shortname, str(e)))
+                            self.categoriesMissing= True
+                            return None
+                finally:
+                    cg.close()
+                self.categoryMembers= members
+            return self.categoryMembers
+        finally:
+            self.categoryLock.release()
 
     def getPreferredPagesPerAction(self):
-        return 200
+        if self.useCategories(self.tlg.wiki + '_p'):
+            return 5000     # category lookups don't touch the database for pages which are not found
+        return self.pagesPerQuery
 
     def createActions(self, language, pages, actionQueue):
-        actionQueue.put(self.Action(self, language, pages))
+        if self.useCategories(language + 'wiki_p'):
+            actionQueue.put(self.CategoryAction(self, language, pages))
+        else:
+            actionQueue.put(self.Action(self, language, pages))
 
 
 ## create a class that filters for templates
 #  @param templateNames dict of iterables containing lists of templates to search for. dict key is wiki db name.
-def makeTemplateFilter(shortname, label, description, group, templateNames):
+#  @param categoryNames optional dict of iterables containing the maintenance categories which correspond to the templates. dict key is wiki db name.
+#         for these wikis, pages are looked up in the categories using CatGraph instead of querying templatelinks if matchInCategories is set.
+def makeTemplateFilter(shortname, label, description, group, templateNames, categoryNames= {}):
     def init(self, tlg):
-        FTemplatesBase.__init__(self, tlg, templateNames)
+        FTemplatesBase.__init__(self, tlg, templateNames, categoryNames)
     return type('F'+shortname, (FTemplatesBase,), {'__init__': init, 'shortname': shortname, 'label': label, 'description': description, 'group': group})
 
 def registerTemplateFilter(*args):
@@ -108,12 +206,16 @@ registerTemplateFilter('TemplateNeutrality', _('Template: Neutrality'), _('Page
     'enwiki_p': [ 'Neutrality' ],
     'frwiki_p': [ 'Désaccord_de_neutralité' ],
     'cswiki_p': [ 'NPOV' ],
+}, {
+    'dewiki_p': [ 'Wikipedia:Neutralität' ],
 })
 
 registerTemplateFilter('TemplateMissingSources', _('Template: Refimprove'), _('Page has \'missing sources\' template set.'), _('Completeness'), {
     'dewiki_p': [ 'Belege_fehlen' ],
     'enwiki_p': [ 'Refimprove' ],
     'frwiki_p': [ 'À_sourcer' ],
+}, {
+    'dewiki_p': [ 'Wikipedia:Belege_fehlen' ],
 })
 
 registerTemplateFilter('TemplateObsolete', _('Template: Out of date'), _('Page has \'out of date\' template set.'), _('Currentness'), {
@@ -121,6 +223,8 @@ registerTemplateFilter('TemplateObsolete', _('Template: Out of date'), _('Page h
     'enwiki_p': [ 'Out_of_date' ],
     'frwiki_p': [ 'Mettre_à_jour' ],
     'cswiki_p': [ 'Aktualizovat' ],
+}, {
+    'dewiki_p': [ 'Wikipedia:Veraltet' ],
 })
 
 registerTemplateFilter('TemplateCleanup', _('Template: Cleanup'), _('Page has \'cleanup\' template set.'), None, {
@@ -128,6 +232,8 @@ registerTemplateFilter('TemplateCleanup', _('Template: Cleanup'), _('Page has \'
     'enwiki_p': [ 'Cleanup' ],
     'frwiki_p': [ 'À_recycler' ],
     'cswiki_p': [ 'Upravit' ], 
+}, {
+    'dewiki_p': [ 'Wikipedia:Überarbeiten' ],
 })
 
 registerTemplateFilter('TemplateTechnical', _('Template: Technical'), _('Page has \'too technical\' template set.'), None, {
@@ -135,6 +241,8 @@ registerTemplateFilter('TemplateTechnical', _('Template: Technical'), _('Page ha
     'enwiki_p': [ 'Technical' ],
     'frwiki_p': [ 'Article_incompréhensible' ],
     'cswiki_p': [ '' ],
+}, {
+    'dewiki_p': [ 'Wikipedia:Allgemeinverständlichkeit' ],
 })
 
 registerTemplateFilter('TemplateGlobalize', _('Template: Globalize'), _('Page has \'globalize\' template set.'), _('Completeness'), {
@@ -142,10 +250,13 @@ registerTemplateFilter('TemplateGlobalize', _('Template: Globalize'), _('Page ha
     'enwiki_p': [ 'Globalize' ],
     'frwiki_p': [ 'Internationaliser' ],
     'cswiki_p': [ 'Globalizovat' ],
+}, {
+    'dewiki_p': [ 'Wikipedia:Staatslastig' ],
 })
 
 # todo: extract template names of other languages from langlinks
 
+# the categories for dewiki are passed to registerTemplateFilter above, they are used with matchInCategories only.
 # todo: gibt es für jedes wartungs-template eine kategorie analog zu http://de.wikipedia.org/wiki/Kategorie:Wikipedia:Neutralit%C3%A4t ? 
 # wenn ja, dann könnte man den ganzen kram durch catgraph-anfragen ersetzen.
 # in der deutschen wikipedia scheint jedem wartungstemplate eine Kategorie:Wikipedia:Wartungstemplate zu entsprechen.
@@ -160,17 +271,13 @@ class FPageSizeBase(FlawFilter):
     
     class Action(TlgAction):
         def execute(self, resultQueue):            
-            cur= getCursors()[self.wiki]
-            format_strings = ','.join(['%s'] * len(self.pageIDs))
-            cur.execute('SELECT page_id, page_len FROM page WHERE page_id IN (%s) AND page_namespace=0 AND page_is_redirect=0' % format_strings, self.pageIDs)
-            rows= cur.fetchall()
+            rows= [ row for row in self.getPageRows(self.pageIDs).itervalues() if row['page_namespace']==NS_MAIN and row['page_is_redirect']==0 ]
             try:
                 self.parent.pageLengthLock.acquire()
                 for row in rows:
                     pagelen= row['page_len']
                     self.parent.pageLengths[row['page_id']]= pagelen
                     self.parent.lengthSum+= pagelen
-                self.parent.pagesLeft-= len(self.pageIDs)
             finally:
                 self.parent.pageLengthLock.release()
 
@@ -184,15 +291,11 @@ class FPageSizeBase(FlawFilter):
                 delta= pageLengths[i]-self.avg
                 sum+= delta*delta
             self.stddev= math.sqrt(sum/len(pageLengths))
-            dprint(3, "FTPageSize.FinalAction.execute() lengthSum = %d pages = %d avg length = %f stddev = %f" % (self.parent.lengthSum, len(pageLengths), self.avg, self.stddev))
-
-        def canExecute(self):
-            return self.parent.pagesLeft == 0
+            dprint(3, "FTPageSize.FinalAction.execute() lengthSum = %d pages = %d avg length = %f stddev = %f", self.parent.lengthSum, len(pageLengths), self.avg, self.stddev)
             
     def __init__(self, tlg):
         FlawFilter.__init__(self, tlg)
-        self.pagesLeft= len(tlg.getPageIDs())
-        self.finalActionCreated= False
+        self.finalAction= None
         self.pageLengths= {}
         self.pageLengthLock= threading.Lock()
         self.lengthSum= 0
@@ -200,11 +303,17 @@ class FPageSizeBase(FlawFilter):
     def getPreferredPagesPerAction(self):
         return 50
     
+    # the final action is released by the scheduler once all the page length actions have finished.
     def createActions(self, language, pages, actionQueue):
-        actionQueue.put(self.Action(self, language, pages))
-        if not self.finalActionCreated: 
-            actionQueue.put(self.FinalAction(self, language, self.tlg.getPageIDs))
-            self.finalActionCreated= True
+        action= FPageSizeBase.Action(self, language, pages)
+        if self.finalAction==None:
+            self.finalAction= self.FinalAction(self, language, self.tlg.getPageIDs())
+            self.finalAction.dependsOn(action)
+            actionQueue.put(action)
+            actionQueue.put(self.finalAction)
+        else:
+            self.finalAction.dependsOn(action)
+            actionQueue.put(action)
 
 class FSmall(FPageSizeBase):
     shortname= 'Small'
@@ -218,18 +327,11 @@ class FSmall(FPageSizeBase):
             if len(pageLengths):
                 self.avg= self.parent.lengthSum / float(len(pageLengths))
                 threshold= self.avg/4
-                for i in pageLengths:
-                    #~ delta= pageLengths[i]-self.avg
-                    #~ if delta > self.stddev*8:
-                        #~ resultQueue.put(TlgResult(self.wiki, getPageByID(self.wiki, i)[0], self.parent))
-                    if pageLengths[i] < threshold:
-                        resultQueue.put(TlgResult(self.wiki, getPageByID(self.wiki, i)[0], self.parent, '%d bytes' % pageLengths[i], sortkey= pageLengths[i]))
-
-    def createActions(self, language, pages, actionQueue):
-        actionQueue.put(FPageSizeBase.Action(self, language, pages))
-        if not self.finalActionCreated: 
-            actionQueue.put(self.FinalAction(self, language, self.tlg.getPageIDs))
-            self.finalActionCreated= True
+                small= [ i for i in pageLengths if pageLengths[i] < threshold ]
+                rows= self.getPageRows(small)
+                for i in small:
+                    if i in rows:
+                        resultQueue.put(TlgResult(self.wiki, rows[i], self.parent, '%d bytes' % pageLengths[i], sortkey= pageLengths[i]))
 
 FlawFilters.register(FSmall)
 
@@ -244,16 +346,11 @@ class FLarge(FPageSizeBase):
         def execute(self, resultQueue):
             FPageSizeBase.FinalAction.execute(self, resultQueue)
             pageLengths= self.parent.pageLengths
-            for i in pageLengths:
-                delta= pageLengths[i]-self.avg
-                if delta > self.stddev*5:
-                    resultQueue.put(TlgResult(self.wiki, getPageByID(self.wiki, i)[0], self.parent, infotext= '%d bytes' % pageLengths[i], sortkey= -pageLengths[i]))
-
-    def createActions(self, language, pages, actionQueue):
-        actionQueue.put(FPageSizeBase.Action(self, language, pages))
-        if not self.finalActionCreated: 
-            actionQueue.put(self.FinalAction(self, language, self.tlg.getPageIDs))
-            self.finalActionCreated= True
+            large= [ i for i in pageLengths if pageLengths[i]-self.avg > self.stddev*5 ]
+            rows= self.getPageRows(large)
+            for i in large:
+                if i in rows:
+                    resultQueue.put(TlgResult(self.wiki, rows[i], self.parent, infotext= '%d bytes' % pageLengths[i], sortkey= -pageLengths[i]))
 
 FlawFilters.register(FLarge)
 
@@ -267,22 +364,21 @@ class FNoImages(FlawFilter):
     description= _('Article has no image links.')
 
     # our action class
-    class Action(TlgAction):
-        def execute(self, resultQueue):
-            cur= getCursors()[self.wiki]
+    class Action(AsyncTlgAction):
+        def executeAsync(self, resultQueue):
             format_strings = ','.join(['%s'] * len(self.pageIDs))
             # IN stuff possibly makes this slow...
-            sqlstr= """SELECT * FROM page WHERE page_namespace=0 AND page_id IN (%s) AND page_is_redirect = 0 
+            sqlstr= """SELECT %s FROM page WHERE page_namespace=0 AND page_id IN (%s) AND page_is_redirect = 0 
                 AND page_id NOT IN (select il_from FROM imagelinks AS src WHERE il_from IN (%s) 
                     AND NOT EXISTS (SELECT 1 FROM imagelinks WHERE il_to=src.il_to AND il_from IN (SELECT page_id FROM page WHERE page_namespace=10)));""" % \
-                    (format_strings, format_strings)
+                    (', '.join(pageColumns), format_strings, format_strings)
                     #~ AND (SELECT COUNT(*) FROM imagelinks WHERE il_to=src.il_to AND il_from IN (SELECT page_id FROM page WHERE page_namespace=10) LIMIT 1)=0);""" % \
-            dblpages= copy.copy(self.pageIDs)
+            dblpages= list(self.pageIDs)
             dblpages.extend(self.pageIDs)
-            cur.execute(sqlstr, dblpages)
-            sqlres= cur.fetchall()
+            rows= yield self.query(sqlstr, dblpages)
 
-            for row in sqlres:
+            self.parent.tlg.pageTable.addRows(rows)
+            for row in rows:
                 resultQueue.put(TlgResult(self.wiki, row, self.parent))
 
 
@@ -301,19 +397,18 @@ class FLonely(FlawFilter):
     description= _('Article is not linked from any other article.')
 
     # our action class
-    class Action(TlgAction):
-        def execute(self, resultQueue):
-            cur= getCursors()[self.wiki]
+    class Action(AsyncTlgAction):
+        def executeAsync(self, resultQueue):
             format_strings = ' OR '.join(['page_id=%s'] * len(self.pageIDs))
             
-            sqlstr= """SELECT * FROM page WHERE (%s) AND page_namespace=0 AND page_is_redirect=0 
+            sqlstr= """SELECT %s FROM page WHERE (%s) AND page_namespace=0 AND page_is_redirect=0 
                 AND NOT EXISTS (SELECT 1 FROM pagelinks WHERE pl_title=page_title AND pl_namespace=0)""" \
-                % (format_strings)
+                % (', '.join(pageColumns), format_strings)
                 #~ AND (SELECT COUNT(*) FROM pagelinks WHERE pl_from=page_id AND pl_namespace=0 LIMIT 1)=0""" 
-            cur.execute(sqlstr, self.pageIDs)
-            sqlres= cur.fetchall()
+            rows= yield self.query(sqlstr, self.pageIDs)
             
-            for row in sqlres:
+            self.parent.tlg.pageTable.addRows(rows)
+            for row in rows:
                 resultQueue.put(TlgResult(self.wiki, row, self.parent))
 
 
@@ -353,14 +448,10 @@ class FPendingChanges(FlawFilter):
             
             if len(foundPageIDs):
                 # then get info about the found articles from the page table
-                format_strings= ' OR '.join(['page_id=%s'] * len(foundPageIDs))
-                sqlstr= """SELECT * FROM page WHERE page_namespace=0 AND page_is_redirect=0 AND (%s)""" % (format_strings)
-                dprint(3, sqlstr)
-                cur.execute(sqlstr, foundPageIDs)
-                sqlres= cur.fetchall()
-                
-                for row in sqlres:
-                    resultQueue.put(TlgResult(self.wiki, row, self.parent))
+                rows= self.getPageRows(foundPageIDs)
+                for row in rows.itervalues():
+                    if row['page_namespace']==NS_MAIN and row['page_is_redirect']==0:
+                        resultQueue.put(TlgResult(self.wiki, row, self.parent))
 
 
     def getPreferredPagesPerAction(self):
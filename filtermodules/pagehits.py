@@ -2,10 +2,11 @@
 # -*- coding:utf-8 -*-
 import time
 import datetime
-import requests
 from tlgflaws import *
 from utils import *
 
+requests= LazyModule('requests')
+
 # snippet from http://stackoverflow.com/questions/1265665/python-check-if-a-string-represents-an-int-without-using-try-except ...
 def isInt_str(v):
     v = str(v).strip()
@@ -44,12 +45,8 @@ class FPagehits(FlawFilter):
     # our action class
     class Action(TlgAction):
         def execute(self, resultQueue):
-            cur= getCursors()[self.wiki]
-            format_strings = ' OR '.join(['page_id=%s'] * len(self.pageIDs))
-            cur.execute("""SELECT page_id, page_namespace, page_title, page_restrictions, page_counter, page_is_redirect, 
-page_is_new, page_random, page_touched, page_latest, page_len 
-FROM page WHERE (page_namespace=0 OR page_namespace=6) AND page_is_redirect=0 AND (%s)""" % format_strings, self.pageIDs)
-            res= cur.fetchall()
+            res= [ row for row in self.getPageRows(self.pageIDs).itervalues() 
+                   if row['page_namespace'] in (NS_MAIN, NS_FILE) and row['page_is_redirect']==0 ]
             
             lastmonth= datetime.datetime.fromtimestamp(time.time())
             statyear= lastmonth.year
@@ -0,0 +1,248 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+# task list generator - asynchronous action executor.
+# runs the executeAsync() coroutines of AsyncTlgActions in one thread. queries are sent without waiting for the result,
+# so that many queries can be in flight over a few connections instead of one blocking connection per worker thread.
+import sys
+import Queue
+import time
+import select
+import threading
+import collections
+import tlgmetrics
+
+from utils import *
+
+
+## a database connection from the ConnectionPool which sends a query and reads its result later.
+class AsyncConnection:
+    def __init__(self, pooled):
+        self.host= pooled.host
+        self.pooled= pooled
+        self.conn= pooled.conn
+
+    def fileno(self):
+        return self.conn.fileno()
+
+    ## send a query, parameters are escaped like MySQLdb cursors do.
+    def send(self, query):
+        self.pooled.selectDB(query.wiki)
+        sql= query.sql
+        if query.params!=None:
+            sql= sql % tuple([ self.conn.literal(param) for param in query.params ])
+        self.conn.send_query(sql)
+
+    ## read the result of the query sent last. returns a tuple of dicts.
+    def receive(self):
+        self.conn.read_query_result()
+        result= self.conn.store_result()
+        if result==None:
+            return ()
+        return result.fetch_row(0, 1)
+
+    ## give the connection back to the pool.
+    def close(self):
+        ConnectionPool.release(self.pooled)
+
+    ## close the connection, e. g. after an error.
+    def discard(self):
+        ConnectionPool.discard(self.pooled)
+
+
+## an action which is being run by the async executor.
+class AsyncTask(object):
+    __slots__= ('action', 'coroutine', 'begin', 'counters', 'querySent')
+
+    def __init__(self, action, coroutine):
+        self.action= action
+        self.coroutine= coroutine
+        self.begin= time.time()
+        self.counters= {}       # ThreadCounters of the coroutine, and the time its queries were in flight
+        self.querySent= None
+
+
+## a thread which runs the coroutines of async actions from the action queue.
+# the thread takes the place of a worker thread: it reports results, finished actions and exceptions to the result queue.
+class AsyncExecutor(threading.Thread):
+    ## constructor
+    # @param maxConnections maximum number of connections per database server.
+    # @param maxActions maximum number of coroutines running at the same time.
+    def __init__(self, actionQueue, resultQueue, runEvent, maxConnections= 4, maxActions= 32):
+        threading.Thread.__init__(self)
+        self.actionQueue= actionQueue
+        self.resultQueue= resultQueue
+        self.runEvent= runEvent
+        self.daemon= True
+        self.maxConnections= maxConnections
+        self.maxActions= maxActions
+        self.numActions= 0                                  # running coroutines
+        self.connections= collections.defaultdict(list)     # host => all connections
+        self.idle= collections.defaultdict(list)            # host => connections without a query in flight
+        self.waiting= collections.defaultdict(collections.deque)   # host => (task, query, time) waiting for a connection
+        self.busy= {}                                       # file descriptor => (connection, task)
+        self.settings= requestContext.get()                 # the request the actions are executed for, see RequestContext
+
+    def getCurrentAction(self):
+        return '%d async actions, %d queries in flight' % (self.numActions, len(self.busy))
+
+    def run(self):
+        try:
+            requestContext.set(self.settings)
+            self.runEvent.wait()
+            while True:
+                # start new coroutines. blocks only if nothing is running.
+                deferred= False     # True if an action could not be executed yet
+                while self.numActions < self.maxActions:
+                    try:
+                        action= self.actionQueue.get(block= self.numActions==0, asyncActions= True)
+                    except Queue.Empty:
+                        break
+                    try:
+                        ready= action.canExecute()
+                    except Exception:
+                        # unhandled exception, propagate to main thread. the action counts as done.
+                        self.resultQueue.put(sys.exc_info())
+                        self.actionQueue.actionDone(action)
+                        self.resultQueue.actionFinished(action)
+                        continue
+                    if not ready:
+                        self.actionQueue.requeue(action)
+                        deferred= True
+                        break
+                    self.numActions+= 1
+                    self.resume(AsyncTask(action, action.executeAsync(self.resultQueue)))
+                if self.numActions==0:
+                    if not deferred:
+                        # get() found no async action which could still become ready
+                        return
+                    # only other threads can make the action executable, try again later
+                    time.sleep(0.05)
+                    continue
+                self.poll(0.05)
+                for host in self.waiting.keys():
+                    self.serveWaiting(host)
+
+        except Exception:
+            # unhandled exception, propagate to main thread
+            self.resultQueue.put(sys.exc_info())
+
+        finally:
+            # connections with a query in flight still have a result to be read, they can't be given back to the pool
+            for conn, task in self.busy.itervalues():
+                self.connections[conn.host].remove(conn)
+                conn.discard()
+            for connections in self.connections.itervalues():
+                for conn in connections:
+                    conn.close()
+            self.resultQueue.workerFinished()
+
+    ## run a coroutine up to its next query, passing in the rows of the last query, or the exception it raised.
+    def resume(self, task, rows= None, exc_info= None):
+        if task.querySent!=None:
+            seconds= time.time()-task.querySent
+            addCounters(task.counters, { 'sqlQueries': 1, 'sqlSeconds': seconds, 'sqlRows': len(rows or ()) })
+            tlgmetrics.sqlDuration.observe(seconds)
+            tlgmetrics.sqlRowsTotal.inc(len(rows or ()))
+            task.querySent= None
+        counters= threadCounters.snapshot()
+        try:
+            if exc_info: query= task.coroutine.throw(*exc_info)
+            else: query= task.coroutine.send(rows)
+        except StopIteration:
+            addCounters(task.counters, threadCounters.since(counters))
+            self.finish(task)
+            return
+        except Exception:
+            addCounters(task.counters, threadCounters.since(counters))
+            self.resultQueue.put(sys.exc_info())
+            self.finish(task)
+            return
+        addCounters(task.counters, threadCounters.since(counters))
+        task.querySent= time.time()
+        self.sendQuery(task, query)
+
+    def finish(self, task):
+        self.resultQueue.stats.addAction(task.action, task.begin, time.time(), task.counters)
+        self.numActions-= 1
+        self.actionQueue.actionDone(task.action)
+        self.resultQueue.actionFinished(task.action)
+
+    ## send a query on an idle connection, or a new one if the server has less than maxConnections.
+    # otherwise, or if the ConnectionPool has no free connection, the query waits until a connection is released.
+    def sendQuery(self, task, query):
+        host= getDBHost(query.wiki)
+        self.waiting[host].append((task, query, time.time()))
+        self.serveWaiting(host)
+    
+    ## get an idle connection to a server, or a new one from the ConnectionPool, without blocking.
+    # returns None if there is none.
+    def getConnection(self, host):
+        if self.idle[host]:
+            return self.idle[host].pop()
+        if len(self.connections[host]) >= self.maxConnections:
+            return None
+        pooled= ConnectionPool.acquire(host, block= False)
+        if pooled==None:
+            return None
+        conn= AsyncConnection(pooled)
+        self.connections[host].append(conn)
+        return conn
+    
+    ## send the queries waiting for a connection to a server, in order, as long as there are connections.
+    # queries which waited longer than ConnectionPool.waitTimeout fail, as they would in ConnectionPool.acquire().
+    def serveWaiting(self, host):
+        waiting= self.waiting[host]
+        while waiting:
+            task, query, since= waiting[0]
+            try:
+                conn= self.getConnection(host)
+            except MySQLdb.Error:
+                waiting.popleft()
+                self.resume(task, exc_info= sys.exc_info())
+                continue
+            if conn==None:
+                break
+            waiting.popleft()
+            self.send(conn, task, query)
+        deadline= time.time() - ConnectionPool.waitTimeout
+        while waiting and waiting[0][2] < deadline:
+            task, query, since= waiting.popleft()
+            error= MySQLdb.OperationalError(1203, 'no free connection to %s in the connection pool after %d seconds' % (host, ConnectionPool.waitTimeout))
+            self.resume(task, exc_info= (type(error), error, None))
+    
+    def send(self, conn, task, query):
+        try:
+            conn.send(query)
+        except MySQLdb.Error:
+            self.dropConnection(conn)
+            self.resume(task, exc_info= sys.exc_info())
+            return
+        self.busy[conn.fileno()]= (conn, task)
+
+    ## wait for query results and resume the coroutines waiting for them.
+    def poll(self, timeout):
+        if not self.busy:
+            # only queries waiting for the ConnectionPool
+            time.sleep(timeout)
+            return
+        readable, writable, exceptional= select.select(self.busy.keys(), [], [], timeout)
+        for fd in readable:
+            conn, task= self.busy.pop(fd)
+            try:
+                rows= conn.receive()
+            except MySQLdb.Error:
+                self.dropConnection(conn)
+                self.resume(task, exc_info= sys.exc_info())
+            else:
+                self.releaseConnection(conn)
+                self.resume(task, rows)
+
+    def releaseConnection(self, conn):
+        self.idle[conn.host].append(conn)
+        self.serveWaiting(conn.host)
+
+    ## close a connection which may be broken. a query waiting for a connection to the same server gets a new one.
+    def dropConnection(self, conn):
+        self.connections[conn.host].remove(conn)
+        conn.discard()
+        self.serveWaiting(conn.host)
@@ -7,9 +7,20 @@ import gettext
 import time
 import json
 import Queue
+import heapq
+import atexit
+import bisect
+import itertools
 import traceback
 import threading
+import multiprocessing
+import multiprocessing.pool
 import tlgflaws
+import tlgasync
+import tlgmetrics
+import tlgcache
+import tlgsets
+import caching
 import wiki
 import geobbox
 
@@ -19,15 +30,12 @@ from utils import *
 
 # todo: daemon threads?
 
-## a worker thread which fetches actions from a queue and executes them
+## a worker thread of the WorkerPool. fetches actions of the running queries from the pool and executes them.
 class WorkerThread(threading.Thread):
-    def __init__(self, actionQueue, resultQueue, wikiname, runEvent):
+    def __init__(self, pool):
         threading.Thread.__init__(self)
-        self.actionQueue= actionQueue
-        self.resultQueue= resultQueue
-        self.wikiname= wikiname
+        self.pool= pool
         self.daemon= True
-        self.runEvent= runEvent
         self.currentAction= ''
     
     def setCurrentAction(self, infoString):
@@ -37,51 +45,165 @@ class WorkerThread(threading.Thread):
         return self.currentAction
     
     def run(self):
-        try:
-            # create cursor which will most likely be used by actions later
-            cur= getCursors()[self.wikiname+'_p']
-            # wait until action queue is ready
-            self.runEvent.wait()
-            
+        while True:
+            # blocks while no query has an action which can be executed
+            job, action= self.pool.getAction()
+            if job==None:
+                return
+            requestContext.set(job.settings)
             try:
-                while True: 
-                    # todo: if there are only actions left which cannot be run, exit the thread
-                    action= self.actionQueue.get(True, 0)
-                    if action.canExecute():
+                counters= threadCounters.snapshot()
+                begin= time.time()
+                ready= True
+                try:
+                    ready= action.canExecute()
+                    if ready:
                         self.setCurrentAction(action.parent.shortname)
                         #~ dprint(1, 'executing action for %s' % action.parent.shortname)
-                        action.execute(self.resultQueue)
-                        #~ dprint(1, 'done.')
-                    else:
-                        dprint(3, "re-queueing action " + str(action) + " from %s, queue len=%d" % (action.parent.shortname, self.actionQueue.qsize()))
-                        self.actionQueue.put(action)
-                    
-                    tempCursors= GetTempCursors()
-                    rmkeys= []
-                    for key in tempCursors:
-                        tc= tempCursors[key]
-                        if time.time() - tc.lastuse > 3:
-                            dprint(0, 'closing temp cursor %s' % tc.key)
-                            tc.cursor.close()
-                            tc.conn.close()
-                            rmkeys.append(key)
-                    for k in rmkeys:
-                        del tempCursors[k]
-                            
-            except Queue.Empty:
+                        action.execute(job.resultQueue)
+                except Exception:
+                    # unhandled exception, propagate to the thread running the query. the action counts as done.
+                    job.resultQueue.put(sys.exc_info())
+                finally:
+                    if ready:
+                        job.resultQueue.stats.addAction(action, begin, time.time(), threadCounters.since(counters))
+                        job.actionQueue.actionDone(action)
+                        releaseCursors()
+                if ready:
+                    job.resultQueue.actionFinished(action)
+                    #~ dprint(1, 'done.')
+                else:
+                    dprint(3, "re-queueing action %s from %s, queue len=%d", action, action.parent.shortname, job.actionQueue.qsize())
+                    job.actionQueue.requeue(action)
+            finally:
                 self.setCurrentAction('')
-                tempCursors= GetTempCursors()
-                for key in tempCursors:
-                    tc= tempCursors[key]
-                    tc.cursor.close()
-                    tc.conn.close()
-                tempCursors.clear()
-                # todo: close other open connections
-                return
-        
-        except Exception:
-            # unhandled exception, propagate to main thread
-            self.resultQueue.put(sys.exc_info())
+                self.pool.actionDone(job)
+
+
+## the actions of a query, as seen by the WorkerPool.
+class WorkerJob(object):
+    __slots__= ('actionQueue', 'resultQueue', 'maxRunning', 'numRunning', 'finished', 'settings')
+    
+    def __init__(self, actionQueue, resultQueue, maxRunning):
+        self.actionQueue= actionQueue
+        self.resultQueue= resultQueue
+        self.maxRunning= maxRunning     # maximum number of actions of this query executed at the same time
+        self.numRunning= 0
+        self.finished= False
+        self.settings= requestContext.get()     # the worker threads execute the actions with the settings of the request
+
+
+## a process-wide pool of worker threads, which is kept between queries. 
+# the actions of concurrent queries are handed out round-robin, so that one large query can't starve the others.
+# each query counts as one worker of its ResultQueue, until all its actions are done.
+class WorkerPool:
+    instance= None
+    instanceLock= threading.Lock()
+    
+    ## get the pool of this process, which is started on first use. the size is set by config['worker-threads'].
+    @staticmethod
+    def get():
+        with WorkerPool.instanceLock:
+            if WorkerPool.instance==None:
+                WorkerPool.instance= WorkerPool(int(config['worker-threads']))
+                atexit.register(WorkerPool.instance.shutdown)
+            return WorkerPool.instance
+    
+    def __init__(self, numThreads):
+        self.condition= threading.Condition()
+        self.stopped= False
+        self.jobs= []       # WorkerJobs of the running queries
+        self.nextJob= 0     # index of the job to look at first in getAction()
+        self.threads= [ WorkerThread(self) for i in range(numThreads) ]
+        for thread in self.threads:
+            thread.start()
+    
+    ## start executing the actions of a query. called by the thread handling the request.
+    # @param maxRunning maximum number of actions of this query executed at the same time
+    def addJob(self, actionQueue, resultQueue, maxRunning):
+        job= WorkerJob(actionQueue, resultQueue, maxRunning)
+        resultQueue.workerStarted()
+        actionQueue.listener= self.wakeUp
+        with self.condition:
+            self.jobs.append(job)
+            self.checkFinished(job)
+            self.condition.notifyAll()
+        return job
+    
+    ## stop handing out actions of a query, e. g. because it was aborted. actions which are being executed are finished.
+    def removeJob(self, job):
+        with self.condition:
+            self.finishJob(job)
+    
+    ## called by the ActionSchedulers when actions become ready or are done.
+    def wakeUp(self):
+        with self.condition:
+            self.condition.notifyAll()
+    
+    ## let the idle worker threads exit before the interpreter shuts down.
+    def shutdown(self):
+        with self.condition:
+            self.stopped= True
+            self.condition.notifyAll()
+        for thread in self.threads:
+            thread.join(1)
+    
+    ## get the next action to execute, round-robin over the running queries. blocks until an action is ready.
+    # returns (None, None) when the pool is shut down.
+    def getAction(self):
+        with self.condition:
+            while not self.stopped:
+                numJobs= len(self.jobs)
+                for i in xrange(numJobs):
+                    job= self.jobs[(self.nextJob+i) % numJobs]
+                    if job.numRunning >= job.maxRunning:
+                        continue
+                    try:
+                        action= job.actionQueue.get(block= False)
+                    except Queue.Empty:
+                        continue
+                    job.numRunning+= 1
+                    self.nextJob= (self.nextJob+i+1) % numJobs
+                    return job, action
+                # no ready actions, remove the queries which are done
+                for job in list(self.jobs):
+                    self.checkFinished(job)
+                self.condition.wait()
+            return None, None
+    
+    ## called by the worker threads when an action handed out by getAction() is done.
+    def actionDone(self, job):
+        with self.condition:
+            job.numRunning-= 1
+            self.checkFinished(job)
+            self.condition.notifyAll()
+    
+    ## remove a query whose actions are all done. must be called with the condition locked.
+    def checkFinished(self, job):
+        if job.numRunning==0 and job.actionQueue.isDone():
+            self.finishJob(job)
+    
+    def finishJob(self, job):
+        if job.finished:
+            return
+        job.finished= True
+        index= self.jobs.index(job)
+        del self.jobs[index]
+        if index < self.nextJob: self.nextJob-= 1
+        if self.nextJob >= len(self.jobs): self.nextJob= 0
+        job.resultQueue.workerFinished()
+    
+    ## number of actions being executed, and ready or waiting to be executed, in all running queries.
+    def getLoad(self):
+        with self.condition:
+            return sum(job.numRunning for job in self.jobs), sum(job.actionQueue.qsize() for job in self.jobs)
+
+tlgmetrics.Gauge('tlg_worker_threads', 'Threads in the WorkerPool.', 
+    function= lambda: len(WorkerPool.instance.threads) if WorkerPool.instance else 0)
+tlgmetrics.Gauge('tlg_workers_busy', 'Worker threads executing an action.', 
+    function= lambda: WorkerPool.instance.getLoad()[0] if WorkerPool.instance else 0)
+tlgmetrics.Gauge('tlg_action_queue_depth', 'Actions of all running queries which are not executed yet.', 
+    function= lambda: WorkerPool.instance.getLoad()[1] if WorkerPool.instance else 0)
 
 
 # replacing Queue with this lock-free container might be faster
@@ -105,38 +227,427 @@ class QueueWrapper(collections.deque):
     def empty(self):
         return len(self)==0
 
+
+## action queue which only hands out actions whose prerequisites have finished (see TlgAction.dependsOn()).
+# actions with unfinished prerequisites are parked until the last prerequisite is done, 
+# worker threads block in get() instead of spinning through the queue while only such actions are left.
+class ActionScheduler:
+    def __init__(self):
+        self.ready= collections.deque()     # actions which can be executed right away
+        self.readyAsync= collections.deque()    # actions which can be executed right away by the async executor
+        self.asyncEnabled= False            # if True, async actions are handed out to the async executor only
+        self.listener= None                 # called when actions become ready or are done, see WorkerPool
+        self.condition= threading.Condition()
+        self.numWaiting= 0                  # parked actions
+        self.numRunning= 0                  # actions handed out, but not done yet
+        self.actions= []                    # all actions which were put into the queue
+    
+    def put(self, action):
+        with self.condition:
+            action.queued= True
+            self.actions.append(action)
+            if action.prerequisites==0:
+                self.makeReady(action)
+                self.condition.notifyAll()
+            else:
+                self.numWaiting+= 1
+        self.notifyListener()
+    
+    ## put back an action which was handed out but could not be executed (TlgAction.canExecute() returned False).
+    def requeue(self, action):
+        with self.condition:
+            self.numRunning-= 1
+            self.makeReady(action)
+            self.condition.notifyAll()
+        self.notifyListener()
+    
+    # called without holding the condition, the listener may take other locks.
+    def notifyListener(self):
+        if self.listener!=None:
+            self.listener()
+    
+    ## get the ready queue for an action.
+    def getReadyQueue(self, action):
+        if self.asyncEnabled and action.isAsync():
+            return self.readyAsync
+        return self.ready
+    
+    ## append an action to its ready queue. must be called with the condition locked.
+    def makeReady(self, action):
+        action.readyTime= time.time()
+        self.getReadyQueue(action).append(action)
+    
+    ## get the next action. 
+    # blocks while actions are parked and their prerequisites are still running, 
+    # raises Queue.Empty if no more actions can become ready.
+    # @param asyncActions if True, get an action for the async executor.
+    def get(self, block=True, timeout=None, asyncActions=False):    # timeout is ignored
+        with self.condition:
+            ready= self.readyAsync if asyncActions else self.ready
+            while not ready:
+                if not block or self.numWaiting==0:
+                    raise Queue.Empty()
+                if self.numRunning==0 and not self.ready and not self.readyAsync:
+                    dprint(0, "ActionScheduler: %d actions left whose prerequisites will never finish" % self.numWaiting)
+                    raise Queue.Empty()
+                self.condition.wait()
+            self.numRunning+= 1
+            return ready.popleft()
+    
+    ## must be called by the worker thread when an action which was handed out by get() is done. 
+    # releases dependent actions whose prerequisites are all done now.
+    def actionDone(self, action):
+        with self.condition:
+            self.numRunning-= 1
+            for dependent in action.dependents:
+                dependent.prerequisites-= 1
+                if dependent.prerequisites==0 and dependent.queued:
+                    self.numWaiting-= 1
+                    self.makeReady(dependent)
+            # wake everyone: released actions can be run, and if nothing is left the workers can exit.
+            self.condition.notifyAll()
+        self.notifyListener()
+    
+    ## return True if no action is running and none can become ready any more.
+    def isDone(self):
+        with self.condition:
+            if self.ready or self.readyAsync or self.numRunning:
+                return False
+            if self.numWaiting:
+                dprint(0, "ActionScheduler: %d actions left whose prerequisites will never finish" % self.numWaiting)
+            return True
+    
+    def qsize(self):
+        return len(self.ready) + len(self.readyAsync) + self.numWaiting
+    
+    def empty(self):
+        return self.qsize()==0
+
+
+## result queue which lets the main thread sleep until something happens.
+# worker threads put results here and report finished actions and their own exit,
+# generateQuery() blocks in wait() instead of polling the worker threads.
+class ResultQueue(QueueWrapper):
+    def __init__(self):
+        QueueWrapper.__init__(self)
+        self.condition= threading.Condition()
+        self.activeWorkers= 0
+        self.actionsProcessed= 0
+        self.changed= False
+        self.stats= QueryStats()
+    
+    def put(self, item):
+        with self.condition:
+            self.append(item)
+            self.changed= True
+            self.condition.notify()
+    
+    ## called once for each worker thread before it is started.
+    def workerStarted(self):
+        with self.condition:
+            self.activeWorkers+= 1
+    
+    ## called by a worker thread when it exits.
+    def workerFinished(self):
+        with self.condition:
+            self.activeWorkers-= 1
+            self.changed= True
+            self.condition.notify()
+    
+    ## called by a worker thread after it executed an action. 
+    # the action is put into the queue after its results, so the main thread knows when the action's pages are done.
+    def actionFinished(self, action):
+        with self.condition:
+            self.append(action)
+            self.actionsProcessed+= 1
+            self.changed= True
+            self.condition.notify()
+    
+    ## true if all worker threads have exited and all results have been fetched.
+    def isFinished(self):
+        with self.condition:
+            return self.activeWorkers==0 and len(self)==0
+    
+    ## block until results are available, an action was finished or the last worker thread exited.
+    def wait(self):
+        with self.condition:
+            # no timeout here: Condition.wait() with a timeout polls in python 2.
+            while len(self)==0 and not self.changed and self.activeWorkers>0:
+                self.condition.wait()
+            self.changed= False
+
+
+
+## timings and counters of a query, per filter and per stage of generateQuery().
+# the worker threads add the timings and ThreadCounters of each action they execute.
+class QueryStats:
+    def __init__(self):
+        self.lock= threading.Lock()
+        self.begin= time.time()
+        self.stages= []         # (stage, seconds) in the order of the stages
+        self.filters= {}        # filter shortname => timings and counters
+        self.query= {}          # counters of the thread running the query
+    
+    ## add an action which was executed from 'begin' to 'end'. 
+    # @param counters the ThreadCounters difference of the action
+    def addAction(self, action, begin, end, counters):
+        with self.lock:
+            stats= self.filters.get(action.parent.shortname)
+            if stats==None:
+                stats= self.filters[action.parent.shortname]= { 'actions': 0, 'queueWait': 0.0, 'maxQueueWait': 0.0, 'seconds': 0.0, 'maxSeconds': 0.0 }
+            queueWait= begin-action.readyTime if action.readyTime else 0.0
+            stats['actions']+= 1
+            stats['queueWait']+= queueWait
+            stats['maxQueueWait']= max(stats['maxQueueWait'], queueWait)
+            stats['seconds']+= end-begin
+            stats['maxSeconds']= max(stats['maxSeconds'], end-begin)
+            addCounters(stats, counters)
+        tlgmetrics.actionsTotal.inc(labels= (action.parent.shortname,))
+        tlgmetrics.actionDuration.observe(end-begin)
+        tlgmetrics.actionQueueWait.observe(queueWait)
+    
+    ## record the end of a stage of the query, which began at the end of the last stage.
+    def endStage(self, stage):
+        now= time.time()
+        self.stages.append( (stage, now - (self.begin + sum(seconds for name, seconds in self.stages))) )
+    
+    ## the stats as a dict for logStats() or the JSON output. 
+    # @param resultsPerFilter the number of results of each filter
+    # @param fileCacheStats the caching.Stats counters at the beginning of the query. they are process-wide, i. e. concurrent queries are included.
+    def getRecord(self, resultsPerFilter, fileCacheStats):
+        def ratio(hits, total):
+            return round(float(hits)/total, 4) if total else None
+        def rounded(d):
+            return dict( (key, round(value, 4) if isinstance(value, float) else value) for key, value in d.iteritems() )
+        with self.lock:
+            totals= dict(self.query)
+            filters= {}
+            for name, stats in self.filters.iteritems():
+                addCounters(totals, dict( (field, stats.get(field, 0)) for field in ThreadCounters.fields ))
+                filters[name]= rounded(dict(stats, results= resultsPerFilter.get(name, 0)))
+        memHits, diskHits, misses= [ new-old for new, old in zip(getFileCacheStats(), fileCacheStats) ]
+        return {
+            'seconds': round(time.time()-self.begin, 4),
+            'stages': rounded(dict(self.stages)),
+            'query': rounded(self.query),
+            'totals': rounded(totals),
+            'filters': filters,
+            'cache': {
+                'pageRows': { 'hits': totals.get('pageCacheHits', 0), 'misses': totals.get('pageCacheMisses', 0),
+                    'hitRatio': ratio(totals.get('pageCacheHits', 0), totals.get('pageCacheHits', 0)+totals.get('pageCacheMisses', 0)) },
+                'files': { 'memHits': memHits, 'diskHits': diskHits, 'misses': misses, 'hitRatio': ratio(memHits+diskHits, memHits+diskHits+misses) },
+            },
+        }
+
+## the counters of the file based cache, (memHits, diskHits, misses).
+def getFileCacheStats():
+    return (caching.Stats.memHits, caching.Stats.diskHits, caching.Stats.misses)
+
         
+## the merged results for one page. 
+# the sort key of the page is kept up to date when results are added, so that sorting the merged results needs no further work.
+# the filters which found the page are kept in a bit mask of filter indices, see FlawFilters.register().
+# all results share the page dict of the first result.
+class MergedResult(object):
+    __slots__= ('page', 'results', 'mask', 'key')
+    
+    def __init__(self, result):
+        self.page= result.page
+        self.results= [ result ]
+        self.mask= 1 << result.FlawFilter.index
+        self.key= (-1,                                  # length of flaw list, 
+                   (result.FlawFilter.shortname,),      # flaw list (alphabetical), 
+                   (result.sortkey,),                   # sort key, 
+                   self.page['page_title'])             # page title (alphabetical)
+    
+    ## add a result, sorted by filter name. 
+    # @return False if the page already has a result from the same filter.
+    def add(self, result):
+        bit= 1 << result.FlawFilter.index
+        if self.mask & bit:
+            return False
+        self.mask|= bit
+        result.page= self.page
+        count, shortnames, sortkeys, title= self.key
+        shortname= result.FlawFilter.shortname
+        i= bisect.bisect(shortnames, shortname)
+        self.results.insert(i, result)
+        j= bisect.bisect(sortkeys, result.sortkey)
+        self.key= (count-1, shortnames[:i] + (shortname,) + shortnames[i:], sortkeys[:j] + (result.sortkey,) + sortkeys[j:], title)
+        return True
+
+
+## entry in the heap of the best results in top-k mode. 
+# the order is reversed, so that the worst of the results kept is on top of the heap.
+class TopResult(object):
+    __slots__= ('key', 'result')
+    def __init__(self, key, result):
+        self.key= key
+        self.result= result
+    def __lt__(self, other):
+        return self.key > other.key
+
+
+## page table of a query. 
+# filters get their page rows from here instead of each querying the page table for the same pages again.
+# rows are fetched the first time any filter asks for them and kept as tuples to save memory.
+class PageTable:
+    def __init__(self, wiki):
+        self.wiki= wiki
+        self.rows= {}       # page_id => tuple of values in the order of pageColumns, or None if the page doesn't exist
+    
+    ## get rows for a list of page IDs. returns a dict page_id => row, page IDs which don't exist are missing in the result.
+    # the rows are created on each call, callers may modify them.
+    def getRows(self, pageIDs):
+        missing= [ pageID for pageID in pageIDs if not pageID in self.rows ]
+        threadCounters.pageCacheHits+= len(pageIDs)-len(missing)
+        threadCounters.pageCacheMisses+= len(missing)
+        if len(missing):
+            fetched= getPagesByIDs(self.wiki, missing)
+            for pageID in missing:
+                row= fetched.get(pageID)
+                self.rows[pageID]= tuple([ row.get(column) for column in pageColumns ]) if row!=None else None
+        result= {}
+        for pageID in pageIDs:
+            values= self.rows[pageID]
+            if values!=None:
+                result[pageID]= dict(zip(pageColumns, values))
+        return result
+    
+    ## add rows which were fetched elsewhere, e. g. joined to some other table.
+    def addRows(self, rows):
+        for row in rows:
+            self.rows[row['page_id']]= tuple([ row.get(column) for column in pageColumns ])
+    
+    def __len__(self):
+        return len(self.rows)
+
+
+## encode the page row and the flaw list of a merged result as a JSON line.
+# this is a module level function, so that it can be run in a process pool.
+def encodeResult(data):
+    page, flaws= data
+    page['page_title']= page['page_title'].replace('_', ' ')
+    return json.dumps({ 'page': page, 'flaws': flaws })
+
+
+## a pool which runs everything in the calling thread.
+class InlinePool:
+    def __init__(self, processes= None):
+        pass
+    def imap(self, func, iterable, chunksize= 1):
+        return itertools.imap(func, iterable)
+    def terminate(self):
+        pass
+
+
+## pool classes for the CPU-bound stages of a query, e. g. encoding the results.
+# the process pool can use more than one core, but needs to pickle the data.
+executors= {
+    'inline': InlinePool,
+    'thread': multiprocessing.pool.ThreadPool,
+    'process': multiprocessing.Pool,
+}
+
+
 ## main app class
 class TaskListGenerator:
-    def __init__(self, numthreads= 10, testrun_= False):
-        self.actionQueue= QueueWrapper()    #Queue.Queue()     # actions to process
-        self.resultQueue= QueueWrapper()    #Queue.Queue()     # results of actions 
+    ## constructor
+    # @param workers maximum number of actions of this query which are executed by the WorkerPool at the same time. 
+    #        the executor uses at most one worker per CPU core.
+    # @param executor key in executors, the pool used for CPU-bound stages.
+    # @param numthreads old name of the workers parameter.
+    # @param asyncConnections if not 0, async actions are run by an AsyncExecutor using at most this many connections per database server.
+    def __init__(self, workers= 10, testrun_= False, executor= 'inline', numthreads= None, asyncConnections= 0):
+        if numthreads!=None:
+            workers= numthreads
+        if not executor in executors:
+            raise InputValidationError('Unknown executor %s' % executor)
+        self.actionQueue= ActionScheduler() # actions to process
+        self.resultQueue= ResultQueue()     # results of actions 
         self.mergedResults= {}              # final merged results, one entry per article
-        self.workerThreads= []
+        self.workerThreads= []              # threads of this query only, the worker threads are in the WorkerPool
+        self.workerJob= None                # the WorkerJob of the running query
         self.pagesToTest= []                # page IDs to test for flaws
-        self.numWorkerThreads= int(numthreads)
+        self.pageTable= None                # PageTable shared by all filters of a query
+        self.numWorkerThreads= int(workers)
+        self.executor= executor
+        self.asyncConnections= int(asyncConnections)
+        self.actionQueue.asyncEnabled= self.asyncConnections>0
         self.language= None                 # language code e.g. 'en'
         self.wiki= None                     # e.g. 'enwiki'
         self.cg= None
+        self.cg_noleaves= False
+        self.threadCatGraphs= threading.local()     # the CatGraphInterface of each thread evaluating query tokens, see getCatGraph()
+        self.clonedCatGraphs= []
+        self.clonedCatGraphsLock= threading.Lock()
         self.runEvent= threading.Event()
         self.loadFilterModules()
-        self.simpleMW= None # SimpleMW instance
+        self.simpleMW= None # SimpleMW instance, see getSimpleMW()
         self.resultsPerFilter= {}           # shortname => resultcount
-        if testrun_: enableTestrun()
+        self.streaming= None                # None, 'merged' or 'unsorted', see generateQuery()
+        self.maxresults= 0                  # number of results to yield, 0 for all
+        self.trackPages= False              # if True, pages are taken out of mergedResults as soon as all their actions are finished
+        self.pendingActions= {}             # page_id => number of unfinished actions testing the page
+        self.finishedResults= collections.deque()   # merged results which can be yielded right away in streaming mode
+        self.topResults= []                 # heap of TopResults in top-k mode
+        self.numFinishedResults= 0          # number of pages taken out of mergedResults
+        self.testedRevisions= {}            # filter shortname => { page_id: page_latest } of the pages tested by filters with cacheVerdicts
+        self.foundVerdicts= {}              # filter shortname => { page_id: (infotext, sortkey) } of these pages
+        self.newVerdicts= {}                # filter shortname => [ (page_id, page_latest, verdict) ] to be stored in the VerdictCache
+        self.verdictFilters= {}             # filter shortname => the FlawFilter whose verdicts are stored
+        self.labels= {}                     # filter shortname => label translated into the language of the request, see resultData()
+        enableTestrun(testrun_)
 
     
     def getActiveWorkerCount(self):
-        count= 0
-        for t in self.workerThreads:
-            if t.isAlive(): count+= 1
-        return count
+        return self.resultQueue.activeWorkers
+    
+    ## the SimpleMW instance for the wiki of the current query. created on first use, only watchlist queries need the API.
+    def getSimpleMW(self):
+        if self.simpleMW==None:
+            self.simpleMW= wiki.SimpleMW(self.language)
+        return self.simpleMW
+    
+    ## the CatGraphInterface for the current thread. the threads which evaluate query tokens get their own copy of self.cg.
+    def getCatGraph(self):
+        cg= getattr(self.threadCatGraphs, 'cg', None)
+        if cg==None:
+            cg= self.threadCatGraphs.cg= self.cg.clone()
+            with self.clonedCatGraphsLock:
+                self.clonedCatGraphs.append(cg)
+        return cg
+    
+    ## get the threads which may be executing actions of this query.
+    def getWorkerThreads(self):
+        return WorkerPool.get().threads + self.workerThreads
     
     @staticmethod
     def mkStatus(string):
         status= json.dumps({'status': string})
         return status
         
-    def loadFilterModules(self):
+    filterModulesLock= threading.Lock()
+    filterModulesLoaded= False
+    
+    ## load the filter modules, once per process. 
+    # the labels, descriptions and groups of the filters are loaded untranslated, they are translated when written out, 
+    # so that requests in different languages can share the modules.
+    @staticmethod
+    def loadFilterModules():
+        with TaskListGenerator.filterModulesLock:
+            if TaskListGenerator.filterModulesLoaded:
+                return
+            settings= requestContext.get()
+            requestContext.translation= None
+            try:
+                TaskListGenerator.importFilterModules()
+            finally:
+                requestContext.set(settings)
+            TaskListGenerator.filterModulesLoaded= True
+    
+    @staticmethod
+    def importFilterModules():
         import imp
         for root, dirs, files in os.walk(os.path.join(sys.path[0], 'filtermodules')):
             for name in files:
@@ -152,7 +663,7 @@ class TaskListGenerator:
                         pass
                     finally:
                         if file: file.close()
-                        if module: dprint(3, "loaded filter module '%s'" % modname)
+                        if module: dprint(3, "loaded filter module '%s'", modname)
 
     def getFlawList(self):
         infoString= '{\n'
@@ -162,7 +673,7 @@ class TaskListGenerator:
             if not firstLine:
                 infoString+= ',\n'
             firstLine= False
-            infoString+= '\t"%s": %s' % (ci.shortname, json.dumps({ 'group': ci.group, 'label': ci.label, 'description': ci.description }))
+            infoString+= '\t"%s": %s' % (ci.shortname, json.dumps({ 'group': ci.group and _(ci.group), 'label': _(ci.label), 'description': _(ci.description) }))
         infoString+= '\n}\n'
         return infoString
     
@@ -196,11 +707,10 @@ class TaskListGenerator:
         if len(s)==1:
             max= 1000000
             if self.cg_noleaves:
-                res= self.cg.getPagesInCategory(string.replace(' ', '_'), int(defaultdepth)-1, )
+                res= self.getCatGraph().getPagesInCategory(string.replace(' ', '_'), int(defaultdepth)-1, )
                 cur= getCursors()[self.wiki+'_p']
                 ret= []
                 # running into problems with huge result set (max_allowed_packet), so doing the query in chunks
-                chunks= lambda coll,size: [ coll[i:i+size] for i in range(0,len(coll),size) ]
                 for chunk in chunks(res, 500):
                     cur.execute("""select N.page_id from page as N 
                     join categorylinks on cl_from=N.page_id 
@@ -213,7 +723,7 @@ class TaskListGenerator:
                         break
                 return ret
             else:
-                res= self.cg.getPagesInCategory(string.replace(' ', '_'), defaultdepth, max)
+                res= self.getCatGraph().getPagesInCategory(string.replace(' ', '_'), defaultdepth, max)
                 return res
         else:
             if s[0]=='wl':  # watchlist
@@ -221,7 +731,7 @@ class TaskListGenerator:
                 if len(wlparams)!=2:
                     raise InputValidationError(_('Watchlist syntax is: wl%cUSERNAME,TOKEN') % separatorChar)
                 res= []
-                for pageid in self.simpleMW.getWatchlistPages(wlparams[0], wlparams[1]):
+                for pageid in self.getSimpleMW().getWatchlistPages(wlparams[0], wlparams[1]):
                     res.append(pageid)
                 return res
             
@@ -254,40 +764,98 @@ class TaskListGenerator:
             else:
                 raise InputValidationError(_('invalid query type: \'%s\'') % s[0])
     
-    def evalQueryString(self, string, depth):
-        result= set()
-        n= 0
+    ## evaluate query tokens at the same time, in up to config['query-threads'] threads.
+    # the tokens are independent, and evaluating one mostly means waiting for catgraph, the database or the API.
+    # returns a dict token => page IDs. if a token can't be evaluated, its exception is raised here.
+    # (multiprocessing.pool.ThreadPool isn't used, terminating it takes up to 0.1 seconds in python 2.)
+    def evalQueryTokens(self, tokens, depth):
+        tokens= sorted(set(tokens), key= tokens.index)
+        self.threadCatGraphs.cg= self.cg
+        if len(tokens)<2:
+            return dict( (token, self.evalQueryToken(token, depth)) for token in tokens )
+        queue= Queue.Queue()
+        for token in tokens:
+            queue.put(token)
+        results= {}     # token => (page IDs, thread counters)
+        errors= []
+        threads= [ threading.Thread(target= self.evalQueryTokensInThread, args= (queue, depth, results, errors, requestContext.get())) for i in range(min(len(tokens), int(config['query-threads']))) ]
+        try:
+            for thread in threads:
+                thread.daemon= True
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            for cg in self.clonedCatGraphs:
+                cg.close()
+            self.clonedCatGraphs= []
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+        pages= {}
+        for token, (ids, counters) in results.iteritems():
+            pages[token]= ids
+            threadCounters.add(counters)
+        return pages
+    
+    ## evaluate query tokens from the queue until it is empty or a token failed. 
+    # the page IDs and the thread counters for the query stats are put into 'results', exceptions into 'errors'.
+    # 'settings' are the RequestContext settings of the calling thread.
+    def evalQueryTokensInThread(self, queue, depth, results, errors, settings):
+        requestContext.set(settings)
+        try:
+            while not errors:
+                try:
+                    token= queue.get_nowait()
+                except Queue.Empty:
+                    return
+                counters= threadCounters.snapshot()
+                results[token]= (self.evalQueryToken(token, depth), threadCounters.since(counters))
+        except Exception:
+            errors.append(sys.exc_info())
+        finally:
+            releaseCursors()
+    
+    ## split a query string into a list of (operator, category) tuples. the operator is '|', '+' or '-'.
+    @staticmethod
+    def parseQueryString(string):
+        tokens= []
         for param in string.split(';'):
             param= param.strip()
             if len(param)==0:
                 raise InputValidationError(_('Empty category name specified.'))
             if param[0] in '+-':
-                category= param[1:].strip()
-                op= param[0]
+                tokens.append( (param[0], param[1:].strip()) )
             else:
-                category= param
-                op= '|'
+                tokens.append( ('|', param) )
+        return tokens
+    
+    def evalQueryString(self, string, depth):
+        tokens= self.parseQueryString(string)
+        # '-' on first category has no effect, so it isn't evaluated
+        pages= self.evalQueryTokens([ category for n, (op, category) in enumerate(tokens) if n!=0 or op!='-' ], depth)
+        result= tlgsets.fromIDs(())
+        n= 0
+        for op, category in tokens:
             if op=='|':
-                result|= set(self.evalQueryToken(category, depth))
-                if 'wl#' in category: dprint(2, ' | "%s"' % 'wl#___,___')
-                else: dprint(2, ' | "%s"' % category)
+                result= tlgsets.union(result, tlgsets.fromIDs(pages[category]))
+                if 'wl#' in category: dprint(2, ' | "%s"', 'wl#___,___')
+                else: dprint(2, ' | "%s"', category)
             elif op=='+':
                 if n==0:
                     # '+' on first category should do the expected thing
-                    result|= set(self.evalQueryToken(category, depth))
-                    dprint(2, ' | "%s"' % category)
+                    result= tlgsets.union(result, tlgsets.fromIDs(pages[category]))
+                    dprint(2, ' | "%s"', category)
                 else:
-                    result&= set(self.evalQueryToken(category, depth))
-                    dprint(2, ' & "%s"' % category)
+                    result= tlgsets.intersection(result, tlgsets.fromIDs(pages[category]))
+                    dprint(2, ' & "%s"', category)
             elif op=='-':
-                # '-' on first category has no effect
                 if n!=0:
-                    result-= set(self.evalQueryToken(category, depth))
-                    dprint(2, ' - "%s"' % category)
+                    result= tlgsets.difference(result, tlgsets.fromIDs(pages[category]))
+                    dprint(2, ' - "%s"', category)
             n+= 1
-        result= list(result)
+        result= tlgsets.toList(result)
         if(len(result) > 1500000):
-            dprint(3, "capping humungous result set (len: %d)..." % len(result))
+            dprint(3, "capping humungous result set (len: %d)...", len(result))
             return result[:1500000]
         else: 
             return result
@@ -298,27 +866,78 @@ class TaskListGenerator:
     # @param queryString The query string. See CatGraphInterface.executeSearchString documentation.
     # @param queryDepth Search recursion depth.
     # @param flaws String of filter names
-    def generateQuery(self, lang, queryString, queryDepth, flaws, include_hidden= False):
+    # @param streaming None to yield the sorted results when all pages are tested. 
+    #        'merged' to yield each page as soon as all filters have tested it, 
+    #        'unsorted' to yield each result as soon as it is found (a page found by several filters is yielded once per filter).
+    #        in both streaming modes, results are not sorted, and finished pages are not kept in memory.
+    # @param maxresults Maximum number of results to yield, 0 for all. 
+    #        if not streaming, only the best maxresults pages are kept while the query is running (top-k mode).
+    # @param useCache if True, the sorted results are taken from the ResultCache if possible, and stored there afterwards.
+    #        filters with cacheVerdicts only test pages which changed since their last verdict. with False, all pages are tested and the verdicts are renewed.
+    def generateQuery(self, lang, queryString, queryDepth, flaws, include_hidden= False, streaming= None, maxresults= 0, timing= False, useCache= True):
+        tlgmetrics.queriesRunning.inc()
+        status= 'aborted'
         try:
             begin= time.time()
+            stats= self.resultQueue.stats
+            counters= threadCounters.snapshot()
+            fileCacheStats= getFileCacheStats()
             
+            if not streaming in (None, 'merged', 'unsorted'):
+                raise InputValidationError('Unknown streaming mode %s' % streaming)
+            self.streaming= streaming
+            self.maxresults= int(maxresults)
+            self.trackPages= streaming=='merged' or (streaming==None and self.maxresults>0)
             self.language= lang
             self.wiki= lang + 'wiki'
-            self.simpleMW= wiki.SimpleMW(lang)
+            self.pageTable= PageTable(self.wiki + '_p')
+            self.simpleMW= None
             self.resultsPerFilter= {}
+            self.testedRevisions= {}
+            self.foundVerdicts= {}
+            self.newVerdicts= {}
+            self.verdictFilters= {}
 
             #~ dprint(0, 'generateQuery(): lang "%s", query string "%s", depth %s, flaws "%s"' % (lang, queryString, queryDepth, flaws))
             #~ dprint(0, 'stats: %s' % json.dumps( { 'lang': lang, 'querystring': queryString, 'depth': queryDepth, 'flaws': flaws } ))
             logStats({ 'lang': lang, 'querystring': queryString, 'depth': queryDepth, 'flaws': flaws })
             
-            # spawn the worker threads
-            self.initThreads()
+            # start the worker threads, if this is the first query of the process
+            WorkerPool.get()
             
             if len(queryString)==0:
                 # todo: use InputValidationError exception
+                status= 'invalid'
                 yield '{"exception": "%s"}' % _('Empty category search string.')
                 return
             
+            # repeated queries are served from the result cache. only complete, sorted results are cached.
+            # watchlists change too often to be cached.
+            # the results may be encoded in other threads, so the labels are translated here
+            self.labels= dict( (name, _(klass.label)) for name, klass in FlawFilters.classInfos.iteritems() )
+            
+            resultCache= None
+            if useCache and streaming==None and not 'wl#' in queryString:
+                resultCache= tlgcache.getResultCache()
+            if resultCache:
+                # the translated filter labels are part of the result lines
+                labels= [ self.labels[name] for name in flaws.split() if name in self.labels ]
+                cacheKey= resultCache.makeKey(lang, self.parseQueryString(queryString), queryDepth, flaws, include_hidden, labels)
+                cached= resultCache.get(cacheKey)
+                if cached:
+                    age, lines= cached
+                    if self.maxresults:
+                        lines= lines[:self.maxresults]
+                    yield self.mkStatus(_('using the result of the same query from %d seconds ago.') % age)
+                    for line in lines:
+                        yield line
+                    stats.endStage('cache')
+                    logStats({'result_cache': 'hit', 'result_size': len(lines)})
+                    if timing:
+                        yield json.dumps({'timing': stats.getRecord(self.resultsPerFilter, fileCacheStats)})
+                    status= 'ok'
+                    return
+            
             yield self.mkStatus(_('evaluating query string \'%s\' with depth %d') % (queryString, int(queryDepth)))
 
             cghost= FindCGHost(self.wiki)
@@ -334,6 +953,7 @@ class TaskListGenerator:
                 self.cg= CatGraphInterface(host= cghost, port= int(config['graphserv-port']), graphname= self.wiki)
                 self.cg_noleaves= False
             self.pagesToTest= self.evalQueryString(queryString, queryDepth)
+            stats.endStage('evaluate')
             
             yield self.mkStatus(_('query found %d results.') % len(self.pagesToTest))
 
@@ -341,75 +961,218 @@ class TaskListGenerator:
             #~ if len(self.pagesToTest) > 50000:
                 #~ raise RuntimeError('result set of %d pages is too large to process in a reasonable time, please modify your search string.' % len(self.pagesToTest))
             
-            # create the actions for every page x every flaw
+            # create the actions for every page x every flaw. 
+            # filters with cacheVerdicts only get the pages which were edited since they were tested last.
+            verdictCache= tlgcache.getVerdictCache()
+            cachedResults= []
             for flawname in flaws.split():
                 try:
                     flaw= FlawFilters.classInfos[flawname](self)
                 except KeyError:
                     raise InputValidationError('Unknown flaw %s' % flawname)
-                self.createActions(flaw, self.language, self.pagesToTest)
+                pages= self.pagesToTest
+                if verdictCache and flaw.cacheVerdicts:
+                    pages= self.useCachedVerdicts(verdictCache, flaw, pages, cachedResults if useCache else None)
+                self.createActions(flaw, self.language, pages)
             
             numActions= self.actionQueue.qsize()
             yield self.mkStatus(_('%d pages to test, %d actions to process') % (len(self.pagesToTest), numActions))
             
-            # signal worker threads that they can run
+            if self.trackPages:
+                self.countPendingActions()
+            self.processCachedResults(cachedResults, include_hidden)
+            stats.endStage('createActions')
+            
+            # give the connections used for evaluating the query to the worker threads
+            releaseCursors()
+            
+            # hand the actions to the worker threads
+            self.initThreads()
             self.runEvent.set()
             
-            # process results as they are created
-            actionsProcessed= 0 #numActions-self.actionQueue.qsize()
-            while self.getActiveWorkerCount()>0 or (not self.resultQueue.empty()):
+            # process results as they are created. wait() returns as soon as there are new results, 
+            # an action was finished or all worker threads have exited.
+            actionsProcessed= 0
+            while not self.resultQueue.isFinished():
+                self.resultQueue.wait()
                 self.drainResultQueue(include_hidden)
-                n= max(numActions-self.actionQueue.qsize()-(self.getActiveWorkerCount()), 0)
+                for line in self.yieldFinishedResults():
+                    yield line
+                n= self.resultQueue.actionsProcessed
                 if n!=actionsProcessed:
                     actionsProcessed= n
-                    eta= (time.time()-begin) / actionsProcessed * (numActions-actionsProcessed)
                     yield json.dumps( { 'progress': '%d/%d' % (actionsProcessed, numActions) } )
                     yield self.mkStatus(_('%d of %d actions processed') % (actionsProcessed, numActions))
-                time.sleep(0.25)
             for i in self.workerThreads:
                 i.join()
             # process the last results
             self.drainResultQueue(include_hidden, 60*60)
-                        
-            # sort
-            sortedResults= sorted(self.mergedResults, key= lambda i: \
-                (-len(self.mergedResults[i]),                                                           # length of flaw list, 
-                 sorted( map(lambda x: x.FlawFilter.shortname, self.mergedResults[i]) ),                # flaw list (alphabetical), 
-                 map( lambda x: x[1], sorted( map(lambda x: (x.FlawFilter.shortname, x.sortkey), 
-                         self.mergedResults[i]), 
-                         key= lambda x: x[1]) ),                                                        # sort key,  
-                 self.mergedResults[i][0].page['page_title']))                                          # page title (alphabetical)
+            for line in self.yieldFinishedResults():
+                yield line
+            for shortname, verdicts in self.newVerdicts.iteritems():
+                verdictCache.store(self.wiki + '_p', self.verdictFilters[shortname].getVerdictCacheName(self.wiki + '_p'), verdicts)
+            stats.endStage('actions')
+            
+            # sort. in streaming and top-k mode, only results for pages which were not in the query are left here (e. g. linked files).
+            if self.trackPages and not self.streaming:
+                for key in self.mergedResults.keys():
+                    self.keepTopResult(self.mergedResults.pop(key))
+                sortedResults= [ entry.result for entry in sorted(self.topResults, key= lambda entry: entry.key) ]
+            else:
+                sortedResults= sorted(self.mergedResults.itervalues(), key= lambda merged: merged.key)
+                if self.maxresults:
+                    sortedResults= sortedResults[:max(0, self.maxresults-self.numFinishedResults)]
+            numResults= len(self.mergedResults)+self.numFinishedResults
+            stats.endStage('sort')
             
             yield self.mkStatus(_('%d pages tested in %d actions. %d pages in result set. processing took %.1f seconds. please wait while the result list is being transferred.') % \
-                (len(self.pagesToTest), numActions, len(self.mergedResults), time.time()-begin))
+                (len(self.pagesToTest), numActions, numResults, time.time()-begin))
             
             logStats({'pages_tested': len(self.pagesToTest), 'action_count': numActions, \
-                'result_size': len(self.mergedResults), 'processingtime': time.time()-begin})
+                'result_size': numResults, 'processingtime': time.time()-begin})
             
             logStats({'results_per_filter': self.resultsPerFilter })
             
             beforeYield= time.time();
             
-            # print results
-            for i in sortedResults:
-                result= self.mergedResults[i]
-                d= { 'page': result[0].page,         #['page_title'].replace('_', ' '), 
-                     'flaws': map( lambda res: { 'name': res.FlawFilter.label, 'infotext': res.infotext, 'hidden': res.marked_as_done }, result )
-                    }
-                d['page']['page_title']= d['page']['page_title'].replace('_', ' ')
-                yield json.dumps(d)
+            # print results. in top-k mode the results are incomplete and can't be cached.
+            cacheLines= [] if resultCache and not self.maxresults else None
+            for line in self.formatResults(sortedResults):
+                if cacheLines!=None: cacheLines.append(line)
+                yield line
+            if cacheLines!=None:
+                resultCache.put(cacheKey, cacheLines)
             
             logStats({'generator_yieldtime': time.time()-beforeYield})
+            
+            stats.endStage('encode')
+            stats.query= threadCounters.since(counters)
+            record= stats.getRecord(self.resultsPerFilter, fileCacheStats)
+            logStats({'timing': record})
+            if timing:
+                yield json.dumps({'timing': record})
+            status= 'ok'
         
         except InputValidationError as e:
+            status= 'invalid'
             dprint(0, 'Input validation failed: %s' % str(e))
             yield '{"exception": "%s:\\n%s"}' % (_('Input validation failed'), str(e))
         
         except Exception as e:
+            status= 'error'
             info= sys.exc_info()
             dprint(0, traceback.format_exc(info[2]))
             yield '{"exception": "%s"}' % (traceback.format_exc(info[2]).replace('\n', '\\n').replace('"', '\\"'))
             return
+        
+        finally:
+            # stop executing actions if the query was aborted
+            if self.workerJob!=None:
+                WorkerPool.get().removeJob(self.workerJob)
+            tlgmetrics.queriesRunning.dec()
+            tlgmetrics.queriesTotal.inc(labels= (status,))
+            tlgmetrics.queryDuration.observe(time.time()-begin)
+    
+    ## get the data encoded by encodeResult() for the merged results of a page.
+    def resultData(self, merged):
+        return (merged.page, [ { 'name': self.labels[res.FlawFilter.shortname], 'infotext': res.infotext, 'hidden': res.marked_as_done } for res in merged.results ])
+    
+    ## encode the merged results for one page as a JSON line.
+    def formatResult(self, merged):
+        return encodeResult(self.resultData(merged))
+    
+    ## encode a list of merged results as JSON lines, using a pool of the configured executor.
+    def formatResults(self, results):
+        pool= executors[self.executor](max(1, min(self.numWorkerThreads, multiprocessing.cpu_count())))
+        try:
+            for line in pool.imap(encodeResult, itertools.imap(self.resultData, results), 500):
+                yield line
+        finally:
+            pool.terminate()
+    
+    ## yield the results which were finished while draining the result queue (streaming mode only).
+    def yieldFinishedResults(self):
+        while len(self.finishedResults):
+            result= self.finishedResults.popleft()
+            self.numFinishedResults+= 1
+            if self.maxresults==0 or self.numFinishedResults<=self.maxresults:
+                yield self.formatResult(result)
+    
+    ## keep the merged results of a page if they are among the best maxresults results seen so far (top-k mode).
+    def keepTopResult(self, merged):
+        self.numFinishedResults+= 1
+        entry= TopResult(merged.key, merged)
+        if len(self.topResults) < self.maxresults:
+            heapq.heappush(self.topResults, entry)
+        elif entry.key < self.topResults[0].key:
+            heapq.heapreplace(self.topResults, entry)
+    
+    ## count the actions testing each page. 
+    # when a page's count drops to zero, it is taken out of mergedResults, see processFinishedAction().
+    def countPendingActions(self):
+        pending= self.pendingActions
+        for action in self.actionQueue.actions:
+            for pageID in action.pageIDs:
+                pending[pageID]= pending.get(pageID, 0) + 1
+    
+    ## called for each action which has been executed, after its results have been processed.
+    def processFinishedAction(self, action):
+        revisions= self.testedRevisions.get(action.parent.shortname)
+        if revisions!=None:
+            found= self.foundVerdicts[action.parent.shortname]
+            self.newVerdicts[action.parent.shortname]+= [ (pageID, revisions[pageID], found.get(pageID)) for pageID in action.pageIDs if pageID in revisions ]
+        if not self.trackPages:
+            return
+        pending= self.pendingActions
+        for pageID in action.pageIDs:
+            count= pending[pageID]-1
+            if count:
+                pending[pageID]= count
+            else:
+                del pending[pageID]
+                self.pageFinished(pageID)
+    
+    ## take the merged result of a page which has been tested by all filters out of mergedResults.
+    def pageFinished(self, pageID):
+        key= '%s_p:%s' % (self.wiki, str(pageID))
+        if key in self.mergedResults:
+            if self.streaming: self.finishedResults.append(self.mergedResults.pop(key))
+            else: self.keepTopResult(self.mergedResults.pop(key))
+    
+    ## look up the verdicts of a filter with cacheVerdicts for the pages whose current revision was tested before.
+    # @param cachedResults results for the known flawed pages are appended here. if None, the verdicts are not looked up, 
+    #        all pages are tested and their verdicts are renewed.
+    # @return the page IDs which have to be tested.
+    def useCachedVerdicts(self, verdictCache, flaw, pageIDs, cachedResults):
+        rows= self.pageTable.getRows(pageIDs)
+        revisions= dict( (pageID, row['page_latest']) for pageID, row in rows.iteritems() )
+        known= {}
+        if cachedResults!=None:
+            known= verdictCache.lookup(self.wiki + '_p', flaw.getVerdictCacheName(self.wiki + '_p'), revisions)
+            for pageID, verdict in known.iteritems():
+                del revisions[pageID]
+                if verdict!=None:
+                    infotext, sortkey= verdict
+                    cachedResults.append(tlgflaws.TlgResult(self.wiki + '_p', rows[pageID], flaw, infotext, sortkey))
+            tlgmetrics.verdictCacheTotal.inc(len(known), ('hit',))
+            tlgmetrics.verdictCacheTotal.inc(len(pageIDs)-len(known), ('miss',))
+            logStats({'verdict_cache': { 'filter': flaw.shortname, 'pages': len(pageIDs), 'known': len(known) }})
+        self.testedRevisions[flaw.shortname]= revisions
+        self.foundVerdicts[flaw.shortname]= {}
+        self.newVerdicts[flaw.shortname]= []
+        self.verdictFilters[flaw.shortname]= flaw
+        if not known:
+            return pageIDs
+        return [ pageID for pageID in pageIDs if not pageID in known ]
+    
+    ## process the results taken from the VerdictCache, after the actions were created.
+    def processCachedResults(self, cachedResults, include_hidden):
+        for result in cachedResults:
+            self.processResult(result, include_hidden)
+        if self.trackPages:
+            for pageID in set( result.page['page_id'] for result in cachedResults ):
+                if not pageID in self.pendingActions:
+                    self.pageFinished(pageID)
     
     ## get IDs of all the pages to be tested for flaws
     def getPageIDs(self):
@@ -456,6 +1219,10 @@ class TaskListGenerator:
             self.resultsPerFilter[result.FlawFilter.shortname]= 1
         else:
             self.resultsPerFilter[result.FlawFilter.shortname]+= 1
+        
+        revisions= self.testedRevisions.get(result.FlawFilter.shortname)
+        if revisions!=None and result.page['page_id'] in revisions:
+            self.foundVerdicts[result.FlawFilter.shortname][result.page['page_id']]= (result.infotext, result.sortkey)
 
         #~ key= '%s:%d' % (result.wiki, result.page['page_id'])
         #~ try:
@@ -467,18 +1234,17 @@ class TaskListGenerator:
         # workaround for file links...
         if result.page['page_namespace']==6:
             result.page['page_title']= "File:" + result.page['page_title']
+        
+        if self.streaming=='unsorted':
+            self.finishedResults.append(MergedResult(result))
+            return
 
         key= '%s:%s' % (result.wiki, str(result.page['page_id']))
         if not key in self.mergedResults:
-            self.mergedResults[key]= [ result ]
-        else:
-            shortnames= [ x.FlawFilter.shortname for x in self.mergedResults[key] ]
-            if result.FlawFilter.shortname in shortnames:
-                #~ dprint(1, 'omitting duplicate %s result' % result.FlawFilter.shortname)
-                pass
-            else:
-                self.mergedResults[key].append(result)
-                self.mergedResults[key].sort(key= lambda x: x.FlawFilter.shortname)
+            self.mergedResults[key]= MergedResult(result)
+        elif not self.mergedResults[key].add(result):
+            #~ dprint(1, 'omitting duplicate %s result' % result.FlawFilter.shortname)
+            pass
             #~ for x in self.mergedResults[key]:
                 #~ if x.FlawFilter.shortname == result.FlawFilter.shortname:
                     #~ dprint(1, 'omitting duplicate %s result for %s' % (result.FlawFilter.shortname, result.page['page_title']))
@@ -495,12 +1261,15 @@ class TaskListGenerator:
         while not self.resultQueue.empty() and time.time()-starttime<timeout:
             result= self.resultQueue.get()
             if isinstance(result, tlgflaws.TlgResult): self.processResult(result, include_hidden)
+            elif isinstance(result, tlgflaws.TlgAction): self.processFinishedAction(result)
             else: self.processWorkerException(result)
 
-    # create and start worker threads
+    # queue the actions in the worker pool, and start the async executor
     def initThreads(self):
-        for i in range(0, self.numWorkerThreads):
-            self.workerThreads.append(WorkerThread(self.actionQueue, self.resultQueue, self.wiki, self.runEvent))
+        self.workerJob= WorkerPool.get().addJob(self.actionQueue, self.resultQueue, self.numWorkerThreads)
+        if self.asyncConnections:
+            self.workerThreads.append(tlgasync.AsyncExecutor(self.actionQueue, self.resultQueue, self.runEvent, self.asyncConnections))
+            self.resultQueue.workerStarted()
             self.workerThreads[-1].start()
 
     def markAsDone(self, pageID, pageTitle, pageRev, filterName, unmark):
@@ -533,54 +1302,6 @@ class TaskListGenerator:
         conn.close()
 
 
-class test:
-    def __init__(self):
-        self.tlg= TaskListGenerator()
-
-    def createActions(self):
-        cg= CatGraphInterface(graphname='dewiki')
-        pages= cg.executeSearchString('Biologie -Meerkatzenverwandte -Astrobiologie', 2)
-        
-        flaw= tlgflaws.FFUnlucky()
-        for k in range(0, 3):
-            for i in pages:
-                action= flaw.createAction( 'de', (i,) )
-                self.tlg.actionQueue.put(action)
-    
-    def drainResultQueue(self):
-        try:
-            while not self.tlg.resultQueue.empty():
-                foo= self.tlg.resultQueue.get()
-                print foo.encodeAsJSON()
-        except (UnicodeEncodeError, UnicodeDecodeError) as exception:  # wtf?!
-            raise
-
-    def testSingleThread(self):
-        self.createActions()
-        numActions= self.tlg.actionQueue.qsize()
-        WorkerThread(self.tlg.actionQueue, self.tlg.resultQueue).run()
-        self.drainResultQueue()
-        print "numActions=%d" % numActions
-        sys.stdout.flush()
-
-    def testMultiThread(self, nthreads):
-        self.createActions()
-        numActions= self.tlg.actionQueue.qsize()
-        for i in range(0, nthreads):
-            dprint(0, "******** before thread start %d" % i)
-            self.tlg.workerThreads.append(WorkerThread(self.tlg.actionQueue, self.tlg.resultQueue))
-            self.tlg.workerThreads[-1].start()
-        while threading.activeCount()>1:
-            self.drainResultQueue()
-            time.sleep(0.5)
-        for i in self.tlg.workerThreads:
-            i.join()
-        self.drainResultQueue()
-        print "numActions=%d" % numActions
-        sys.stdout.flush()
-
-
-
 if __name__ == '__main__':
     gettext.translation('tlgbackend', localedir= os.path.join(sys.path[0], 'messages'), languages=['de']).install()
     #~ TaskListGenerator().listFlaws()
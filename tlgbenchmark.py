@@ -0,0 +1,531 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+# task list generator - benchmarks.
+# the benchmarks run against a generated sqlite fixture database instead of the wiki replicas, 
+# and a local stand-in for graphserv (FakeGraphServ).
+# usage: tlgbenchmark.py BENCHMARK [ARGS...], run without arguments for a list of benchmarks.
+import os
+import sys
+import time
+import json
+import random
+import multiprocessing
+import resource
+import shutil
+import sqlite3
+import gettext
+import tempfile
+import threading
+import SocketServer
+
+from utils import *
+
+
+## query and row counters of a fixture database.
+class FixtureStats:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.queries= 0
+        self.rows= 0
+
+
+## a cursor on the fixture database which behaves like a MySQLdb DictCursor.
+# MySQL parameter placeholders are translated, 'USE' statements are ignored.
+class FixtureCursor:
+    def __init__(self, conn, stats):
+        self.conn= conn
+        self.cursor= conn.cursor()
+        self.stats= stats
+
+    def execute(self, query, params= ()):
+        if query.strip().upper().startswith('USE '):
+            return
+        if isinstance(params, (int, long, basestring)):
+            params= (params,)
+        self.cursor.execute(query.replace('%s', '?').replace('%%', '%'), tuple(params))
+        self.stats.queries+= 1
+
+    def fetchall(self):
+        columns= [ d[0] for d in self.cursor.description ]
+        rows= tuple([ dict(zip(columns, row)) for row in self.cursor.fetchall() ])
+        self.stats.rows+= len(rows)
+        return rows
+
+    def fetchone(self):
+        row= self.cursor.fetchone()
+        if row==None: return None
+        self.stats.rows+= 1
+        return dict(zip([ d[0] for d in self.cursor.description ], row))
+
+    def close(self):
+        self.cursor.close()
+
+
+## a connection to the fixture database which can be used by the ConnectionPool in place of a MySQLdb connection.
+# all wiki databases are the same fixture database.
+class FixtureConnection:
+    def __init__(self, db):
+        self.db= db
+        self.conn= db.connect()
+
+    def cursor(self):
+        return FixtureCursor(self.conn, self.db.stats)
+
+    def select_db(self, name):
+        pass
+
+    def ping(self):
+        pass
+
+    def close(self):
+        self.conn.close()
+
+
+## a generated sqlite database with the tables used by the filters.
+class FixtureDB:
+    def __init__(self, numPages, seed= 23):
+        self.dir= tempfile.mkdtemp(prefix= 'tlgbenchmark-')
+        self.path= os.path.join(self.dir, 'fixture.db')
+        self.numPages= numPages
+        self.random= random.Random(seed)
+        self.stats= FixtureStats()
+        conn= self.connect()
+        conn.executescript("""
+            CREATE TABLE page (page_id INTEGER PRIMARY KEY, page_namespace INTEGER, page_title VARBINARY, page_restrictions VARBINARY,
+                page_counter INTEGER, page_is_redirect INTEGER, page_is_new INTEGER, page_random REAL, page_touched VARBINARY,
+                page_latest INTEGER, page_len INTEGER);
+            CREATE INDEX page_name_title ON page (page_namespace, page_title);
+            CREATE TABLE templatelinks (tl_from INTEGER, tl_namespace INTEGER, tl_title VARBINARY);
+            CREATE INDEX tl_from ON templatelinks (tl_from, tl_namespace, tl_title);
+            CREATE INDEX tl_namespace ON templatelinks (tl_namespace, tl_title, tl_from);
+            CREATE TABLE imagelinks (il_from INTEGER, il_to VARBINARY);
+            CREATE INDEX il_from ON imagelinks (il_from, il_to);
+            CREATE INDEX il_to ON imagelinks (il_to, il_from);
+            CREATE TABLE pagelinks (pl_from INTEGER, pl_namespace INTEGER, pl_title VARBINARY);
+            CREATE INDEX pl_from ON pagelinks (pl_from, pl_namespace, pl_title);
+            CREATE INDEX pl_namespace ON pagelinks (pl_namespace, pl_title, pl_from);
+            CREATE TABLE categorylinks (cl_from INTEGER, cl_to VARBINARY);
+            CREATE INDEX cl_from ON categorylinks (cl_from, cl_to);
+            CREATE TABLE flaggedpages (fp_page_id INTEGER PRIMARY KEY, fp_reviewed INTEGER, fp_pending_since VARBINARY);
+            CREATE TABLE geo_tags (gt_id INTEGER PRIMARY KEY, gt_page_id INTEGER, gt_lat REAL, gt_lon REAL);
+            CREATE INDEX gt_page_id ON geo_tags (gt_page_id);
+            CREATE TABLE revision (rev_id INTEGER PRIMARY KEY, rev_page INTEGER, rev_parent_id INTEGER, rev_timestamp VARBINARY);
+            CREATE INDEX rev_page ON revision (rev_page, rev_parent_id);
+        """)
+        conn.commit()
+        conn.close()
+
+    def connect(self):
+        conn= sqlite3.connect(self.path, check_same_thread= False)
+        conn.text_factory= str
+        return conn
+
+    def cursor(self):
+        return FixtureCursor(self.connect(), self.stats)
+
+    ## the IDs of the articles.
+    def getPageIDs(self):
+        return range(1, self.numPages+1)
+
+    def execute(self, query, rows):
+        conn= self.connect()
+        conn.executemany(query, rows)
+        conn.commit()
+        conn.close()
+
+    ## add the articles, touched in the last 60 days.
+    def addPages(self):
+        rnd= self.random
+        self.execute('INSERT INTO page VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            ( (i, NS_MAIN, 'Page_%d' % i, '', 0, 0, 0, rnd.random(), MakeMWTimestamp(time.time()-rnd.random()*60*24*60*60), 1000000+i, int(rnd.lognormvariate(8, 1)))
+              for i in self.getPageIDs() ))
+
+    ## add a category page, the articles are put into it by FakeGraphServ. returns the page ID.
+    def addCategory(self, title):
+        pageID= self.numPages+1
+        self.execute('INSERT INTO page VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [ (pageID, NS_CATEGORY, title, '', 0, 0, 0, 0.5, MakeMWTimestamp(), 1, 100) ])
+        return pageID
+
+    ## add file pages for 'numFiles' files, half of which exist locally, and link 'perPage' random files from each article.
+    def addImagelinks(self, numFiles, perPage):
+        rnd= self.random
+        firstID= self.numPages+2
+        self.execute('INSERT INTO page VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            ( (firstID+i, NS_FILE, 'File_%d.jpg' % i, '', 0, 0, 0, rnd.random(), MakeMWTimestamp(), 2000000+i, 1000) for i in xrange(0, numFiles, 2) ))
+        self.execute('INSERT INTO imagelinks VALUES (?, ?)',
+            ( (i, 'File_%d.jpg' % f) for i in self.getPageIDs() for f in set(rnd.randint(0, numFiles-1) for n in xrange(rnd.randint(0, perPage*2))) ))
+
+    ## add 'perPage' links to random articles from each article on average.
+    def addPagelinks(self, perPage):
+        rnd= self.random
+        self.execute('INSERT INTO pagelinks VALUES (?, ?, ?)',
+            ( (i, NS_MAIN, 'Page_%d' % rnd.randint(1, self.numPages)) for i in self.getPageIDs() for n in xrange(rnd.randint(0, perPage*2)) ))
+
+    ## add flagged revision state for all articles, 'pendingRatio' of them have pending changes.
+    def addFlaggedpages(self, pendingRatio):
+        rnd= self.random
+        self.execute('INSERT INTO flaggedpages VALUES (?, ?, ?)',
+            ( (i, 0, MakeMWTimestamp(time.time()-rnd.random()*7*24*60*60)) if rnd.random() < pendingRatio else (i, 1, None) for i in self.getPageIDs() ))
+
+    ## add coordinates to 'ratio' of the articles.
+    def addGeotags(self, ratio):
+        rnd= self.random
+        self.execute('INSERT INTO geo_tags (gt_page_id, gt_lat, gt_lon) VALUES (?, ?, ?)',
+            ( (i, rnd.uniform(-90, 90), rnd.uniform(-180, 180)) for i in self.getPageIDs() if rnd.random() < ratio ))
+
+    ## add the first revision of each article, created in the last 2 years.
+    def addRevisions(self):
+        rnd= self.random
+        self.execute('INSERT INTO revision VALUES (?, ?, ?, ?)',
+            ( (i, i, 0, MakeMWTimestamp(time.time()-rnd.random()*2*365*24*60*60)) for i in self.getPageIDs() ))
+
+    ## create all tables used by the filters.
+    def addAll(self, templatesPerPage= 30, flawRatio= 0.05):
+        self.addPages()
+        self.addTemplatelinks(templatesPerPage, 'Belege_fehlen', flawRatio)
+        self.addImagelinks(max(2, self.numPages/10), 2)
+        self.addPagelinks(5)
+        self.addFlaggedpages(flawRatio)
+        self.addGeotags(flawRatio*4)
+        self.addRevisions()
+
+    ## add 'perPage' random templatelinks to each page, and the template 'flawTemplate' to 'flawRatio' of the pages.
+    def addTemplatelinks(self, perPage, flawTemplate, flawRatio):
+        rnd= self.random
+        def links():
+            for i in self.getPageIDs():
+                for name in rnd.sample(xrange(perPage*10), perPage):
+                    yield (i, NS_TEMPLATE, 'Template_%d' % name)
+                if rnd.random() < flawRatio:
+                    yield (i, NS_TEMPLATE, flawTemplate)
+        self.execute('INSERT INTO templatelinks VALUES (?, ?, ?)', links())
+
+    ## make getCursors() in the current thread return cursors on this database.
+    def install(self):
+        db= self
+        class Cursors(DictCache):
+            def createEntry(self, key):
+                return db.cursor()
+        CachedThreadValue('SQLCursors', Cursors)
+        threading.currentThread().cache['SQLCursors']= Cursors()
+
+    ## make the ConnectionPool connect to this database, so that all threads use it.
+    def installPool(self):
+        db= self
+        ConnectionPool.connect= staticmethod(lambda host: FixtureConnection(db))
+
+    def remove(self):
+        shutil.rmtree(self.dir)
+
+
+## a local stand-in for graphserv, speaking the line protocol of gp.client.
+# it serves one graph, in which each category contains the given pages. 
+# traversals return the category and its pages, regardless of the depth.
+class FakeGraphServ(SocketServer.ThreadingTCPServer):
+    daemon_threads= True
+    allow_reuse_address= True
+
+    ## @param categories dict category page ID => list of page IDs
+    def __init__(self, categories, address= ('localhost', 0)):
+        SocketServer.ThreadingTCPServer.__init__(self, address, FakeGraphServHandler)
+        self.categories= categories
+        self.numCommands= 0
+
+    def getPort(self):
+        return self.server_address[1]
+
+    ## handle requests in a daemon thread.
+    def start(self):
+        thread= threading.Thread(target= self.serve_forever, name= 'FakeGraphServ')
+        thread.daemon= True
+        thread.start()
+
+class FakeGraphServHandler(SocketServer.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line + '\r\n')
+
+    def handle(self):
+        while True:
+            line= self.rfile.readline()
+            if not line:
+                return
+            command= line.split()
+            if not command:
+                continue
+            self.server.numCommands+= 1
+            if command[0]=='protocol-version':
+                self.reply('OK. 4')
+            elif command[0]=='use-graph':
+                self.reply('OK. using graph %s' % command[1])
+            elif command[0]=='traverse-successors':
+                pages= self.server.categories.get(int(command[1]))
+                if pages==None:
+                    self.reply('NONE.')
+                    continue
+                if len(command)>3:
+                    pages= pages[:int(command[3])]
+                self.reply('OK. %d nodes:' % (len(pages)+1))
+                self.wfile.write(''.join('%d\r\n' % node for node in [int(command[1])] + pages) + '\r\n')
+            elif command[0]=='quit':
+                self.reply('OK. bye')
+                return
+            else:
+                self.reply('FAILED! unknown command %s' % command[0])
+            self.wfile.flush()
+
+
+def timeit(function, *args):
+    begin= time.time()
+    result= function(*args)
+    return time.time()-begin, result
+
+
+## compare matching template names in SQL against fetching all templatelinks rows (FTemplatesBase.matchInSQL).
+def benchmarkTemplates(numPages= 20000, templatesPerPage= 30):
+    from tlgbackend import TaskListGenerator, PageTable, ResultQueue
+    from tlgflaws import FlawFilters
+    numPages= int(numPages)
+    templatesPerPage= int(templatesPerPage)
+    tlg= TaskListGenerator()
+    tlg.wiki= 'dewiki'
+    flawClass= FlawFilters.classInfos['TemplateMissingSources']
+    db= FixtureDB(numPages)
+    try:
+        db.addPages()
+        db.addTemplatelinks(templatesPerPage, 'Belege_fehlen', 0.05)
+        db.install()
+        pageIDs= db.getPageIDs()
+        print '%d pages, %d templatelinks per page' % (numPages, templatesPerPage)
+        for matchInSQL in (False, True):
+            PageRowCache.rows.clear()
+            tlg.pageTable= PageTable('dewiki_p')
+            flaw= flawClass(tlg)
+            flaw.matchInSQL= matchInSQL
+            resultQueue= ResultQueue()
+            db.stats.reset()
+            def run():
+                for chunk in chunks(pageIDs, flaw.getPreferredPagesPerAction()):
+                    flaw.Action(flaw, 'de', chunk).execute(resultQueue)
+            seconds, foo= timeit(run)
+            print '%-16s %8.3f s %8d queries %10d rows fetched %8d results' % \
+                ('match in sql' if matchInSQL else 'match in python', seconds, db.stats.queries, db.stats.rows, len(resultQueue))
+    finally:
+        db.remove()
+
+
+## synthetic results for numPages pages, found by random filters.
+def makeResults(numResults, numPages):
+    from tlgflaws import FlawFilters, TlgResult
+    rnd= random.Random(23)
+    flaws= [ FlawFilters.classInfos[name] for name in sorted(FlawFilters.classInfos) ]
+    pages= [ {'page_id': i, 'page_namespace': NS_MAIN, 'page_title': 'Page_%d' % i} for i in xrange(1, numPages+1) ]
+    return [ TlgResult('dewiki_p', rnd.choice(pages), rnd.choice(flaws), sortkey= rnd.randint(0, 1000)) for i in xrange(numResults) ]
+
+
+## merge and sort synthetic results (TaskListGenerator.processResult() and the final sort in generateQuery()).
+# the old sort, which computed the sort key of each page from its result list, is timed for reference.
+def benchmarkSort(numResults= 500000, numPages= 200000):
+    from tlgbackend import TaskListGenerator
+    numResults= int(numResults)
+    numPages= int(numPages)
+    tlg= TaskListGenerator()
+    results= makeResults(numResults, numPages)
+    print '%d results, %d pages' % (numResults, numPages)
+    def merge():
+        for result in results:
+            tlg.processResult(result)
+    seconds, foo= timeit(merge)
+    print '%-16s %8.3f s %8d merged pages %8d kB max rss' % ('merge', seconds, len(tlg.mergedResults), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    seconds, foo= timeit(lambda: sorted(tlg.mergedResults.itervalues(), key= lambda merged: merged.key))
+    print '%-16s %8.3f s' % ('sort', seconds)
+    lists= dict( (key, merged.results) for key, merged in tlg.mergedResults.iteritems() )
+    def oldSort():
+        return sorted(lists, key= lambda i: \
+            (-len(lists[i]), 
+             sorted( map(lambda x: x.FlawFilter.shortname, lists[i]) ), 
+             map( lambda x: x[1], sorted( map(lambda x: (x.FlawFilter.shortname, x.sortkey), lists[i]), key= lambda x: x[1]) ), 
+             lists[i][0].page['page_title']))
+    seconds, foo= timeit(oldSort)
+    print '%-16s %8.3f s' % ('old sort', seconds)
+
+
+## encode merged results as JSON lines with each executor (TaskListGenerator.formatResults()).
+def benchmarkEncode(numResults= 500000, numPages= 200000, workers= multiprocessing.cpu_count()):
+    from tlgbackend import TaskListGenerator, executors
+    numResults= int(numResults)
+    numPages= int(numPages)
+    workers= int(workers)
+    print '%d results, %d pages, %d workers' % (numResults, numPages, workers)
+    for executor in sorted(executors):
+        tlg= TaskListGenerator(workers, executor= executor)
+        for result in makeResults(numResults, numPages):
+            tlg.processResult(result)
+        merged= tlg.mergedResults.values()
+        seconds, lines= timeit(lambda: list(tlg.formatResults(merged)))
+        print '%-16s %8.3f s %8d lines' % (executor, seconds, len(lines))
+
+
+## per-request overhead of a 'listflaws' request: one process per request (CGI mode) against a warm server process (tlgwsgi.runServer()).
+def benchmarkStartup(numRequests= 20):
+    import subprocess
+    numRequests= int(numRequests)
+    environ= { 'QUERY_STRING': 'action=listflaws&i18n=de', 'REQUEST_METHOD': 'GET' }
+    script= os.path.join(sys.path[0], 'tlgwsgi.py')
+    def cgi():
+        for i in xrange(numRequests):
+            subprocess.check_output([sys.executable, script], env= dict(os.environ, **environ))
+    seconds, foo= timeit(cgi)
+    print '%-16s %8.1f ms per request' % ('cgi', seconds*1000/numRequests)
+    import tlgwsgi
+    seconds, foo= timeit(tlgwsgi.warmUp)
+    print '%-16s %8.1f ms' % ('server warm-up', seconds*1000)
+    def server():
+        for i in xrange(numRequests):
+            ''.join(tlgwsgi.generator_app(dict(environ), lambda status, headers: None))
+    seconds, foo= timeit(server)
+    print '%-16s %8.1f ms per request' % ('server', seconds*1000/numRequests)
+
+
+## import time of the main modules, each measured in a fresh interpreter (like 'python -X importtime', which python 2 lacks).
+# the database drivers and the other heavy modules should only be imported when they are used.
+def benchmarkImports(numRuns= 10):
+    import subprocess
+    numRuns= int(numRuns)
+    heavyModules= ('MySQLdb', 'sqlite3', 'beaker', 'wikitools', 'requests', 'numpy')
+    script= """import sys, time
+begin= time.time()
+import %s
+print time.time()-begin
+print ' '.join(name for name in %r if name in sys.modules)
+"""
+    for module in ('utils', 'tlgflaws', 'tlgbackend', 'tlgwsgi'):
+        times= []
+        for i in xrange(numRuns):
+            output= subprocess.check_output([sys.executable, '-c', script % (module, heavyModules)], cwd= sys.path[0]).split('\n')
+            times.append(float(output[0]))
+        times.sort()
+        print '%-16s %8.1f ms median %8.1f ms min   loaded: %s' % (module, times[len(times)/2]*1000, times[0]*1000, output[1] or '-')
+
+
+## run one query in a forked process, so that the peak memory of each query can be measured separately.
+def runQuery(flaws, results, **kwargs):
+    from tlgbackend import TaskListGenerator
+    error= None
+    timing= {}
+    numResults= 0
+    for line in TaskListGenerator().generateQuery('de', 'Fixture', 1, flaws, timing= True, **kwargs):
+        data= json.loads(line)
+        if 'flaws' in data: numResults+= 1
+        elif 'timing' in data: timing= data['timing']
+        elif 'exception' in data: error= data['exception'].strip().split('\n')[-1]
+    results.put( (timing, numResults, error, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss) )
+
+## run a query for each filter against the fixture database and a FakeGraphServ, instead of the replicas and sylvester.
+# filters which need services outside of the fixture are skipped, unless they are given explicitly.
+# @param filters space separated filter names, or 'all'
+def benchmarkFilters(numPages= 20000, filters= 'all', workers= 10):
+    from tlgflaws import FlawFilters
+    from tlgbackend import TaskListGenerator
+    import utils
+    utils.debuglevel= -1    # keep the per-query log messages out of the table
+    numPages= int(numPages)
+    config['worker-threads']= int(workers)
+    config['result-cache-ttl']= 0      # measure the filters, not the caches
+    config['verdict-cache-ttl']= 0
+    TaskListGenerator.loadFilterModules()
+    if filters=='all':
+        external= ('ArticleFeedbackRatings', 'ChangeDetector', 'Pagehits')
+        filters= [ name for name in sorted(FlawFilters.classInfos) if not name in external ]
+    else:
+        filters= filters.split()
+    db= FixtureDB(numPages)
+    try:
+        seconds, foo= timeit(db.addAll)
+        catID= db.addCategory('Fixture')
+        print '%d pages, fixture created in %.1f s' % (numPages, seconds)
+        graphserv= FakeGraphServ({ catID: db.getPageIDs() })
+        graphserv.start()
+        config['graphserv-port']= graphserv.getPort()
+        config['graphserv-hosts']= { 'dewiki': 'localhost' }
+        db.installPool()
+        print '%-26s %8s %10s %8s %8s %10s %8s %10s' % ('filter', 'seconds', 'pages/s', 'actions', 'sql', 'rows', 'results', 'max rss kB')
+        for name in filters:
+            results= multiprocessing.Queue()
+            process= multiprocessing.Process(target= runQuery, args= (name, results))
+            process.start()
+            timing, numResults, error, maxrss= results.get()
+            process.join()
+            if error:
+                print '%-26s %s' % (name, error)
+                continue
+            totals= timing['totals']
+            actions= sum(stats['actions'] for stats in timing['filters'].itervalues())
+            print '%-26s %8.2f %10.0f %8d %8d %10d %8d %10d' % (name, timing['seconds'], numPages/timing['seconds'], actions,
+                totals.get('sqlQueries', 0), totals.get('sqlRows', 0), numResults, maxrss)
+        graphserv.shutdown()
+    finally:
+        db.remove()
+
+
+## evaluate a query string on synthetic categories of numIDs page IDs each (TaskListGenerator.evalQueryString()),
+# with tlgsets and with the python sets evalQueryString used before. 
+# the categories are sorted arrays, like the ones returned by CatGraphInterface.getPagesInCategory().
+def benchmarkSets(numIDs= 1000000, numRuns= 5):
+    import array
+    import tlgsets
+    from tlgbackend import TaskListGenerator
+    numIDs= int(numIDs)
+    numRuns= int(numRuns)
+    rnd= random.Random(23)
+    categories= dict( (name, array.array('l', sorted(rnd.sample(xrange(numIDs*4), numIDs)))) for name in 'ABCD' )
+    print '%d page IDs per category, %s' % (numIDs, 'numpy %s' % tlgsets.numpy.__version__ if tlgsets.getBackend()==tlgsets.NumpyBackend else 'without numpy')
+    def pythonSets(op, a, b):
+        a= set(a)
+        if op=='|': a|= set(b)
+        elif op=='&': a&= set(b)
+        else: a-= set(b)
+        return list(a)
+    def arraySets(op, a, b):
+        functions= { '|': tlgsets.union, '&': tlgsets.intersection, '-': tlgsets.difference }
+        return tlgsets.toList(functions[op](tlgsets.fromIDs(a), tlgsets.fromIDs(b)))
+    tlg= TaskListGenerator()
+    tlg.evalQueryToken= lambda category, depth: categories[category]
+    def oldEvalQueryString():
+        result= set(categories['A'])
+        result|= set(categories['B'])
+        result&= set(categories['C'])
+        result-= set(categories['D'])
+        return list(result)
+    for name, old, new in (
+            ('union', lambda: pythonSets('|', categories['A'], categories['B']), lambda: arraySets('|', categories['A'], categories['B'])),
+            ('intersection', lambda: pythonSets('&', categories['A'], categories['B']), lambda: arraySets('&', categories['A'], categories['B'])),
+            ('difference', lambda: pythonSets('-', categories['A'], categories['B']), lambda: arraySets('-', categories['A'], categories['B'])),
+            ('A; B; +C; -D', oldEvalQueryString, lambda: tlg.evalQueryString('A; B; +C; -D', 1)) ):
+        oldSeconds= min( timeit(old)[0] for i in xrange(numRuns) )
+        newSeconds, result= min( (timeit(new) for i in xrange(numRuns)), key= lambda run: run[0] )
+        if sorted(old())!=sorted(result):
+            print '%-16s results differ!' % name
+        print '%-16s %8.3f s python sets %8.3f s tlgsets %6.1fx %8d page IDs' % (name, oldSeconds, newSeconds, oldSeconds/newSeconds, len(result))
+
+
+benchmarks= {
+    'encode': benchmarkEncode,
+    'filters': benchmarkFilters,
+    'imports': benchmarkImports,
+    'sets': benchmarkSets,
+    'sort': benchmarkSort,
+    'startup': benchmarkStartup,
+    'templates': benchmarkTemplates,
+}
+
+
+if __name__ == '__main__':
+    gettext.NullTranslations().install()
+    if len(sys.argv)<2 or not sys.argv[1] in benchmarks:
+        print 'usage: %s BENCHMARK [ARGS...]' % sys.argv[0]
+        print 'benchmarks: %s' % ', '.join(sorted(benchmarks))
+        sys.exit(1)
+    benchmarks[sys.argv[1]](*sys.argv[2:])
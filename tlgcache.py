@@ -0,0 +1,187 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+# task list generator - caches for query results and filter verdicts.
+import os
+import time
+import gzip
+import json
+import hashlib
+import threading
+from utils import *
+
+
+## normalize a query string parsed by TaskListGenerator.parseQueryString(), so that equivalent queries get the same cache key.
+# spaces in category names become underscores, and '+' on the first category is the same as no operator.
+# categories in a run of the same operator are sorted, because union, intersection and difference with several sets don't depend on the order.
+def normalizeQuery(tokens):
+    result= []
+    run= []
+    for op, token in tokens:
+        if '#' not in token:
+            token= token.replace(' ', '_')
+        if op=='+' and not result and not run:
+            op= '|'
+        if run and run[-1][0]!=op:
+            result+= sorted(run)
+            run= []
+        run.append( (op, token) )
+    return result + sorted(run)
+
+
+## cache for the result lines of finished queries, so that repeated requests (paging, other output formats, reloads) are served
+# without running the query again. entries are gzipped JSON lines files in DATADIR/result-cache, named by a hash of the normalized query.
+# expired entries are removed in the background.
+class ResultCache:
+    ## @param ttl seconds after which entries expire
+    def __init__(self, directory, ttl):
+        self.directory= directory
+        self.ttl= ttl
+        try:
+            os.makedirs(directory)
+        except OSError:
+            pass    # exists
+        runInBackground(self.cleanup, ttl)
+
+    ## the cache key of a query.
+    # @param labels the filter labels as written into the result lines, they depend on the language of the request.
+    @staticmethod
+    def makeKey(lang, tokens, depth, flaws, include_hidden, labels= ()):
+        key= [ str(lang).lower(), normalizeQuery(tokens), int(depth), sorted(set(flaws.split())), bool(include_hidden), sorted(set(labels)) ]
+        return hashlib.sha1(json.dumps(key)).hexdigest()
+
+    def getPath(self, key):
+        return os.path.join(self.directory, key + '.json.gz')
+
+    ## get the result lines of a query, or None if they are not cached or expired.
+    # returns (age in seconds, lines).
+    def get(self, key):
+        path= self.getPath(key)
+        try:
+            age= time.time() - os.path.getmtime(path)
+            if age > self.ttl:
+                return None
+            with gzip.open(path, 'rb') as f:
+                return age, [ line.rstrip('\n') for line in f ]
+        except (IOError, OSError):
+            return None
+
+    ## store the result lines of a query. the entry is written to a temporary file first, so readers never see a partial entry.
+    def put(self, key, lines):
+        path= self.getPath(key)
+        tmpPath= '%s.%d.%s.tmp' % (path, os.getpid(), threading.currentThread().ident)
+        try:
+            with gzip.open(tmpPath, 'wb', 6) as f:
+                for line in lines:
+                    f.write(line)
+                    f.write('\n')
+            os.rename(tmpPath, path)
+        except (IOError, OSError) as e:
+            dprint(0, 'ResultCache: could not write %s: %s', path, e)
+            try: os.unlink(tmpPath)
+            except OSError: pass
+
+    ## remove expired entries, and temporary files left behind by crashed processes.
+    def cleanup(self):
+        expired= time.time() - self.ttl
+        for name in os.listdir(self.directory):
+            path= os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < expired:
+                    os.unlink(path)
+            except OSError:
+                pass    # removed by another process
+
+resultCache= None
+resultCacheLock= threading.Lock()
+
+## get the ResultCache of this process, or None if config['result-cache-ttl'] is 0.
+def getResultCache():
+    global resultCache
+    if not config['result-cache-ttl']:
+        return None
+    with resultCacheLock:
+        if resultCache==None:
+            resultCache= ResultCache(os.path.join(DATADIR, 'result-cache'), int(config['result-cache-ttl']))
+        return resultCache
+
+
+## cache for the verdicts of filters which only depend on the current revision of a page (see FlawFilter.cacheVerdicts).
+# a verdict is stored with the page_latest of the tested revision, and is valid as long as the page was not edited,
+# so re-running a large task list only needs the page rows to find the pages which have to be tested again.
+# the verdicts are kept in an sqlite database in DATADIR. entries expire after ttl seconds, as a verdict can also 
+# change when something outside of the page changes, e. g. a template included by a template.
+class VerdictCache:
+    # max. number of page IDs in one lookup query, sqlite allows 999 parameters
+    chunkSize= 500
+    
+    def __init__(self, path, ttl):
+        self.path= path
+        self.ttl= ttl
+        runInBackground(self.cleanup, 24*60*60)
+
+    def connect(self):
+        conn= sqlite3.connect(self.path, timeout= 30.0)
+        conn.execute("""CREATE TABLE IF NOT EXISTS verdicts (wiki TEXT, filter TEXT, page_id INTEGER, page_latest INTEGER, 
+            verdict TEXT, checked REAL, PRIMARY KEY (wiki, filter, page_id))""")
+        conn.execute('CREATE INDEX IF NOT EXISTS checked ON verdicts (checked)')
+        return conn
+
+    ## find out which of the given page revisions were tested before.
+    # @param revisions dict page_id => page_latest
+    # @return dict page_id => verdict for the pages whose revision is known. the verdict is None if the filter didn't find the page, 
+    # (infotext, sortkey) otherwise.
+    def lookup(self, wiki, filterName, revisions):
+        known= {}
+        pageIDs= list(revisions)
+        try:
+            conn= self.connect()
+            try:
+                for start in xrange(0, len(pageIDs), self.chunkSize):
+                    chunk= pageIDs[start:start+self.chunkSize]
+                    rows= conn.execute('SELECT page_id, page_latest, verdict FROM verdicts WHERE wiki=? AND filter=? AND checked>=? AND page_id IN (%s)' % \
+                        ','.join('?' * len(chunk)), [wiki, filterName, time.time()-self.ttl] + chunk)
+                    for pageID, pageLatest, verdict in rows:
+                        if pageLatest==revisions[pageID]:
+                            known[pageID]= tuple(json.loads(verdict)) if verdict!=None else None
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            dprint(0, 'VerdictCache: lookup failed: %s', e)
+        return known
+
+    ## store verdicts.
+    # @param verdicts list of (page_id, page_latest, verdict) tuples, verdict as returned by lookup().
+    def store(self, wiki, filterName, verdicts):
+        now= time.time()
+        try:
+            conn= self.connect()
+            try:
+                with conn:
+                    conn.executemany('INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?, ?, ?)', 
+                        [ (wiki, filterName, pageID, pageLatest, json.dumps(verdict) if verdict!=None else None, now) for pageID, pageLatest, verdict in verdicts ])
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            dprint(0, 'VerdictCache: could not store %d verdicts: %s', len(verdicts), e)
+
+    ## remove expired verdicts.
+    def cleanup(self):
+        conn= self.connect()
+        try:
+            with conn:
+                conn.execute('DELETE FROM verdicts WHERE checked < ?', (time.time()-self.ttl,))
+        finally:
+            conn.close()
+
+verdictCache= None
+verdictCacheLock= threading.Lock()
+
+## get the VerdictCache of this process, or None if config['verdict-cache-ttl'] is 0.
+def getVerdictCache():
+    global verdictCache
+    if not config['verdict-cache-ttl']:
+        return None
+    with verdictCacheLock:
+        if verdictCache==None:
+            verdictCache= VerdictCache(os.path.join(DATADIR, 'verdicts.db'), int(config['verdict-cache-ttl']))
+        return verdictCache
@@ -1,36 +1,109 @@
 #!/usr/bin/python
 # task list generator - interface to catgraph
 import time
-import requests
-from gp import *
+import array
+import threading
+import collections
+import tlgmetrics
+from gp import client
 from utils import *
 
+requests= LazyModule('requests')
+
+## find the graphserv host which serves a graph.
+#  config['graphserv-hosts'] (graph name => host) overrides the hostmap, e. g. for a local graphserv.
 def FindCGHost(graphname):
+    hosts= config.get('graphserv-hosts')
+    if hosts!=None:
+        return hosts.get(graphname)
     r= requests.get('http://sylvester/hostmap/%s' % graphname)
     if r.status_code==200:
         return r.text
     return None
 
+## in-memory LRU cache for category traversals, keyed by (graph name, category ID, depth, max).
+# popular categories are requested by many queries. the page IDs are kept as sorted arrays, which take much less memory than lists of ints.
+# the least recently used entries are evicted when the arrays take more than maxBytes.
+class TraversalCache:
+    lifetime= 10*60                     # seconds. short, the category graph is updated continuously
+    maxBytes= 256*1024*1024
+    entries= collections.OrderedDict()  # key => (expiry time, array of page IDs), least recently used first
+    numBytes= 0
+    lock= threading.Lock()
+    
+    ## get the page IDs of a traversal, or None if it is not cached or expired.
+    @staticmethod
+    def get(key):
+        with TraversalCache.lock:
+            entry= TraversalCache.entries.pop(key, None)
+            if entry==None:
+                return None
+            if entry[0]<=time.time():
+                TraversalCache.numBytes-= getArrayBytes(entry[1])
+                return None
+            TraversalCache.entries[key]= entry
+            return entry[1]
+    
+    @staticmethod
+    def put(key, pageIDs):
+        size= getArrayBytes(pageIDs)
+        if size > TraversalCache.maxBytes:
+            return
+        with TraversalCache.lock:
+            old= TraversalCache.entries.pop(key, None)
+            if old!=None:
+                TraversalCache.numBytes-= getArrayBytes(old[1])
+            TraversalCache.entries[key]= (time.time() + TraversalCache.lifetime, pageIDs)
+            TraversalCache.numBytes+= size
+            while TraversalCache.numBytes > TraversalCache.maxBytes:
+                expires, evicted= TraversalCache.entries.popitem(last= False)[1]
+                TraversalCache.numBytes-= getArrayBytes(evicted)
+
+def getArrayBytes(a):
+    return a.itemsize*len(a)
+
+tlgmetrics.Gauge('tlg_catgraph_cache_bytes', 'Size of the page ID arrays in the TraversalCache.', function= lambda: TraversalCache.numBytes)
+
 class CatGraphInterface:
     def __init__(self, host='ortelius.toolserver.org', port=6666, graphname=None):
         self.gp= client.Connection( client.ClientTransport(host, port), graphname )
         self.gp.connect()
+        self.host= host
+        self.port= port
         self.graphname= graphname
         self.wikiname= (graphname.split('_')[0] if graphname.endswith('_ns14') else graphname)  + '_p' 
     
+    ## a new interface to the same graph, with its own connection. a connection can't be used by several threads at the same time.
+    def clone(self):
+        return CatGraphInterface(self.host, self.port, self.graphname)
+    
+    def close(self):
+        self.gp.close()
+    
+    ## get the IDs of the pages in a category and its subcategories up to 'depth', as a sorted array('l').
+    # traversals are cached in the TraversalCache. the array is a copy, callers may modify it.
     def getPagesInCategory(self, category, depth=2, max=None):
         catID= getCategoryID(self.wikiname, category)
         if catID!=None:
-            result= []
+            key= (self.graphname, catID, int(depth), max)
+            result= TraversalCache.get(key)
+            if result!=None:
+                tlgmetrics.catgraphCacheTotal.inc(labels= ('hit',))
+                return array.array('l', result)
+            tlgmetrics.catgraphCacheTotal.inc(labels= ('miss',))
+            begin= time.time()
             if max:
                 successors= self.gp.capture_traverse_successors(catID, str(depth), str(max))
             else:
                 successors= self.gp.capture_traverse_successors(catID, str(depth))
-            if successors:  # result can be None for empty categories
-                # convert list of tuples to simple list. is there a faster (i.e. built-in) way to do this?
-                for i in successors:
-                    result.append(i[0])
-            return result
+            seconds= time.time()-begin
+            threadCounters.catgraphCalls+= 1
+            threadCounters.catgraphSeconds+= seconds
+            tlgmetrics.catgraphDuration.observe(seconds)
+            # result can be None for empty categories
+            result= array.array('l', sorted( i[0] for i in successors or () ))
+            TraversalCache.put(key, result)
+            return array.array('l', result)
         else:
             # category not found. 
             raise InputValidationError(_('Category %s not found in database %s.') % (category, self.wikiname))
@@ -61,20 +134,20 @@ class CatGraphInterface:
                 op= '|'
             if op=='|':
                 result|= set(self.getPagesInCategory(category, depth))
-                dprint(2, ' | "%s"' % category)
+                dprint(2, ' | "%s"', category)
             elif op=='+':
                 if n==0:
                     # '+' on first category should do the expected thing
                     result|= set(self.getPagesInCategory(category, depth))
-                    dprint(2, ' | "%s"' % category)
+                    dprint(2, ' | "%s"', category)
                 else:
                     result&= set(self.getPagesInCategory(category, depth))
-                    dprint(2, ' & "%s"' % category)
+                    dprint(2, ' & "%s"', category)
             elif op=='-':
                 # '-' on first category has no effect
                 if n!=0:
                     result-= set(self.getPagesInCategory(category, depth))
-                    dprint(2, ' - "%s"' % category)
+                    dprint(2, ' - "%s"', category)
             n+= 1
         return list(result)
         
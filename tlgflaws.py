@@ -20,6 +20,11 @@ class FlawFilters:
     def register(klass):
         try:
             FlawFilters.lock.acquire()
+            # the index identifies the filter in the merged results, it stays the same when a filter module is reloaded.
+            if klass.shortname in FlawFilters.classInfos:
+                klass.index= FlawFilters.classInfos[klass.shortname].index
+            else:
+                klass.index= len(FlawFilters.classInfos)
             FlawFilters.classInfos[klass.shortname]= klass
             if not 'group' in klass.__dict__:
                 klass.group= None
@@ -35,6 +40,16 @@ class FlawFilter(object):
     def __init__(self, tlg):
         self.tlg= tlg
     
+    # set this to True if the filter finds a page only depending on the current revision of the page, and not on other pages 
+    # or the rest of the query. the verdicts are then kept in the VerdictCache, and pages whose revision was tested before are not tested again.
+    # actions of such filters must only put results for their own pages, with the row from getPageRows() or one like it.
+    cacheVerdicts= False
+    
+    ## the name the verdicts of this filter are kept under in the VerdictCache. 
+    # filters which can find pages in different ways override this, so that verdicts found in different ways don't mix.
+    def getVerdictCacheName(self, wiki):
+        return self.shortname
+    
     ## override this method if you want to process more than one article per action.
     def getPreferredPagesPerAction(self):
         return 1
@@ -51,18 +66,77 @@ class TlgAction:
         self.language= language
         self.wiki= language+'wiki_p'
         self.pageIDs= pages
+        self.prerequisites= 0       # number of unfinished actions this action has to wait for
+        self.dependents= []         # actions waiting for this action to finish
+        self.queued= False          # set by the action queue
+        self.readyTime= None        # when the action became ready to be executed, set by the action queue
     
     ## test the pages and put TlgResults describing flawed pages into resultQueue 
     def execute(self, resultQueue):
         raise NotImplementedError("execute() not implemented")
     
+    ## get rows for some page IDs from the page table of the current query.
+    #  returns a dict page_id => row, page IDs which don't exist are missing in the result.
+    def getPageRows(self, pageIDs):
+        return self.parent.tlg.pageTable.getRows(pageIDs)
+    
+    ## declare that this action must not be executed before 'action' has finished.
+    # 'action' must not have been put into the action queue yet.
+    def dependsOn(self, action):
+        self.prerequisites+= 1
+        action.dependents.append(self)
+    
     ## in subclasses, return False here if this action needs to wait for the result of other actions.
+    # actions which return False are re-queued until they can be executed, use dependsOn() instead if possible.
     def canExecute(self):
         return True
+    
+    ## return True if the action can be run by the async executor, see AsyncTlgAction.
+    def isAsync(self):
+        return False
+
+
+## a query yielded by the executeAsync() coroutine of an AsyncTlgAction.
+class SQLQuery(object):
+    __slots__= ('wiki', 'sql', 'params')
+    
+    def __init__(self, wiki, sql, params= None):
+        self.wiki= wiki
+        self.sql= sql
+        self.params= params
+
+
+## base class for actions which can be run as coroutines by the async executor (see tlgasync.py).
+# executeAsync() is a generator which yields SQLQuery objects and is resumed with the result rows of each query,
+# like those returned by fetchall() of a DictCursor. 
+# execute() runs the same coroutine in the worker thread, using the thread's cursors.
+class AsyncTlgAction(TlgAction):
+    def executeAsync(self, resultQueue):
+        raise NotImplementedError("executeAsync() not implemented")
+    
+    ## create a query on the wiki database of this action.
+    def query(self, sql, params= None):
+        return SQLQuery(self.wiki, sql, params)
+    
+    def execute(self, resultQueue):
+        coroutine= self.executeAsync(resultQueue)
+        try:
+            query= coroutine.next()
+            while True:
+                cur= getCursors()[query.wiki]
+                cur.execute(query.sql, query.params)
+                query= coroutine.send(cur.fetchall())
+        except StopIteration:
+            pass
+    
+    def isAsync(self):
+        return True
 
 
 ## the result of a TlgAction, describing a flawed page
-class TlgResult:
+class TlgResult(object):
+    __slots__= ('wiki', 'page', 'FlawFilter', 'infotext', 'sortkey', 'marked_as_done')
+    
     ## constructor
     #  @param wiki the name of the wiki this page was found in
     #  @param page a dict containing the full page result page_title, page_id etc.
@@ -84,9 +158,9 @@ class FNop(FlawFilter):
     # our action class
     class Action(TlgAction):
         def execute(self, resultQueue):
-            dprint(3, "%s: execute begin" % (self.parent.description))
+            dprint(3, "%s: execute begin", self.parent.description)
             time.sleep(0.1) # do "work"
-            dprint(3, "%s: execute end" % (self.parent.description))
+            dprint(3, "%s: execute end", self.parent.description)
 
     # create a no-op action object
     def createActions(self, language, pages, actionQueue):
@@ -105,15 +179,15 @@ class FUnlucky(FlawFilter):
     # our action class
     class Action(TlgAction):
         def execute(self, resultQueue):
-            dprint(3, "%s: execute begin" % (self.parent.description))
+            dprint(3, "%s: execute begin", self.parent.description)
             
-            for i in self.pageIDs:
-                if i % 13 == 0: # unlucky ID!
-                    rows= getPageByID(self.wiki, i)
-                    if len(rows):
-                        resultQueue.put(TlgResult(self.wiki, rows[0], self.parent))
+            unlucky= [ i for i in self.pageIDs if i % 13 == 0 ]
+            rows= self.getPageRows(unlucky)
+            for i in unlucky:
+                if i in rows:
+                    resultQueue.put(TlgResult(self.wiki, rows[i], self.parent))
             
-            dprint(3, "%s: execute end" % (self.parent.description))
+            dprint(3, "%s: execute end", self.parent.description)
 
     def createActions(self, language, pages, actionQueue):
         actionQueue.put(self.Action(self, language, pages))
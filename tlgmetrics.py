@@ -0,0 +1,134 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+# task list generator - process-wide metrics in the prometheus text format.
+# the metrics are kept in memory and updated where things happen, so that scraping them (tlgwsgi, action=metrics)
+# doesn't touch the databases. they are only useful in server mode (tlgwsgi.py --fcgi or --http), a CGI process serves one request.
+import bisect
+import threading
+
+# all metrics, in the order they were created
+registry= []
+
+
+## base class for metrics. a metric has one value per combination of label values.
+class Metric:
+    type= None
+
+    ## @param labelNames names of the labels, label values are passed as a tuple in the same order.
+    # @param function if given, it is called when the metric is rendered and returns the value, or a dict label values => value.
+    def __init__(self, name, help, labelNames= (), function= None):
+        self.name= name
+        self.help= help
+        self.labelNames= labelNames
+        self.function= function
+        self.lock= threading.Lock()
+        self.values= {}     # tuple of label values => value
+        registry.append(self)
+
+    def formatLabels(self, labelValues, extra= ()):
+        labels= zip(self.labelNames, labelValues) + list(extra)
+        if not labels:
+            return ''
+        return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in labels)
+
+    def getValues(self):
+        if self.function!=None:
+            value= self.function()
+            return value if isinstance(value, dict) else { (): value }
+        with self.lock:
+            return dict(self.values)
+
+    def render(self):
+        lines= [ '# HELP %s %s' % (self.name, self.help), '# TYPE %s %s' % (self.name, self.type) ]
+        for labelValues, value in sorted(self.getValues().iteritems()):
+            lines+= self.renderValue(labelValues, value)
+        return lines
+
+    def renderValue(self, labelValues, value):
+        return [ '%s%s %s' % (self.name, self.formatLabels(labelValues), formatNumber(value)) ]
+
+
+## a value which only goes up, e. g. the number of queries served.
+class Counter(Metric):
+    type= 'counter'
+
+    def inc(self, amount= 1, labels= ()):
+        with self.lock:
+            self.values[labels]= self.values.get(labels, 0) + amount
+
+
+## a value which goes up and down, e. g. the number of running queries.
+class Gauge(Metric):
+    type= 'gauge'
+
+    def set(self, value, labels= ()):
+        with self.lock:
+            self.values[labels]= value
+
+    def inc(self, amount= 1, labels= ()):
+        with self.lock:
+            self.values[labels]= self.values.get(labels, 0) + amount
+
+    def dec(self, amount= 1, labels= ()):
+        self.inc(-amount, labels)
+
+
+## counts observed values, e. g. latencies, in buckets with the given upper bounds.
+class Histogram(Metric):
+    type= 'histogram'
+    defaultBuckets= (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+    def __init__(self, name, help, labelNames= (), buckets= defaultBuckets):
+        Metric.__init__(self, name, help, labelNames)
+        self.buckets= tuple(buckets)
+
+    def observe(self, value, labels= ()):
+        index= bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry= self.values.get(labels)
+            if entry==None:
+                entry= self.values[labels]= [ [0]*(len(self.buckets)+1), 0.0 ]   # counts per bucket, sum
+            entry[0][index]+= 1
+            entry[1]+= value
+
+    def getValues(self):
+        with self.lock:
+            return dict( (labels, (list(counts), total)) for labels, (counts, total) in self.values.iteritems() )
+
+    def renderValue(self, labelValues, value):
+        counts, total= value
+        lines= []
+        cumulative= 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            cumulative+= count
+            lines.append('%s_bucket%s %d' % (self.name, self.formatLabels(labelValues, [('le', formatNumber(bound))]), cumulative))
+        lines.append('%s_sum%s %s' % (self.name, self.formatLabels(labelValues), formatNumber(total)))
+        lines.append('%s_count%s %d' % (self.name, self.formatLabels(labelValues), cumulative))
+        return lines
+
+
+def formatNumber(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+## the text exposition format of all metrics.
+def render():
+    lines= []
+    for metric in registry:
+        lines+= metric.render()
+    return '\n'.join(lines) + '\n'
+
+
+queriesTotal= Counter('tlg_queries_total', 'Queries served, by outcome.', ('status',))
+queryDuration= Histogram('tlg_query_duration_seconds', 'Time from the start of a query until its last result line.')
+queriesRunning= Gauge('tlg_queries_running', 'Queries being processed.')
+actionsTotal= Counter('tlg_actions_total', 'Actions executed, by filter.', ('filter',))
+actionDuration= Histogram('tlg_action_duration_seconds', 'Time spent executing an action.')
+actionQueueWait= Histogram('tlg_action_queue_wait_seconds', 'Time an action waited for a worker after it became ready.')
+sqlDuration= Histogram('tlg_sql_query_duration_seconds', 'Duration of SQL round trips.')
+sqlRowsTotal= Counter('tlg_sql_rows_total', 'Rows fetched from the database.')
+catgraphDuration= Histogram('tlg_catgraph_call_duration_seconds', 'Duration of catgraph traversals.')
+catgraphCacheTotal= Counter('tlg_catgraph_cache_lookups_total', 'Category traversals looked up in the TraversalCache, by result.', ('result',))
+pageRowCacheTotal= Counter('tlg_page_row_cache_lookups_total', 'Page table rows looked up in the PageRowCache, by result.', ('result',))
+verdictCacheTotal= Counter('tlg_verdict_cache_lookups_total', 'Filter verdicts looked up in the VerdictCache, by result.', ('result',))
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+# task list generator - set algebra on page IDs, for evaluating query strings.
+# the categories of a query can contain millions of pages. with numpy, page ID sets are sorted arrays without duplicates,
+# combined with merges based on binary search (searchsorted). this is several times faster than python sets,
+# and takes 8 bytes per page ID instead of a boxed int plus a hash table slot.
+# without numpy, python sets are used: merging sorted arrays in pure python is slower than hashing.
+# usage: s= fromIDs(ids), s= union(s, fromIDs(...)) etc., toList(s) for the page IDs.
+import array
+
+numpy= None     # the numpy module, imported on first use (see getBackend()), as it takes a while to load
+
+
+## sets of page IDs as sorted numpy arrays.
+class NumpyBackend:
+    @staticmethod
+    def fromIDs(ids):
+        if isinstance(ids, array.array) and ids.typecode=='l' and len(ids):   # numpy.int_ is a C long, like array('l')
+            ids= numpy.frombuffer(ids, numpy.int_)
+        else:
+            ids= numpy.fromiter(ids, numpy.int_)
+        # arrays from the TraversalCache are sorted and unique already
+        if len(ids)<2 or (ids[1:]>ids[:-1]).all():
+            return ids
+        return numpy.unique(ids)
+
+    ## boolean array, True for the elements of x which are in y.
+    @staticmethod
+    def contains(y, x):
+        if len(y)==0:
+            return numpy.zeros(len(x), numpy.bool_)
+        index= numpy.searchsorted(y, x)
+        index[index==len(y)]= 0
+        return y[index]==x
+
+    @staticmethod
+    def union(a, b):
+        extra= b[~NumpyBackend.contains(a, b)]
+        return numpy.insert(a, numpy.searchsorted(a, extra), extra)
+
+    @staticmethod
+    def intersection(a, b):
+        return a[NumpyBackend.contains(b, a)]
+
+    @staticmethod
+    def difference(a, b):
+        return a[~NumpyBackend.contains(b, a)]
+
+    @staticmethod
+    def toList(s):
+        return s.tolist()
+
+
+## sets of page IDs as python sets.
+class PythonBackend:
+    @staticmethod
+    def fromIDs(ids):
+        return set(ids)
+
+    @staticmethod
+    def union(a, b):
+        a|= b
+        return a
+
+    @staticmethod
+    def intersection(a, b):
+        a&= b
+        return a
+
+    @staticmethod
+    def difference(a, b):
+        a-= b
+        return a
+
+    @staticmethod
+    def toList(s):
+        return list(s)
+
+
+backend= None
+
+## get NumpyBackend if numpy can be imported, PythonBackend otherwise.
+def getBackend():
+    global numpy, backend
+    if backend==None:
+        try:
+            import numpy as module
+            numpy= module
+            backend= NumpyBackend
+        except ImportError:
+            backend= PythonBackend
+    return backend
+
+## a set of page IDs, from a sequence like the ones returned by CatGraphInterface.getPagesInCategory().
+# the operations below may modify their first argument.
+def fromIDs(ids):
+    return getBackend().fromIDs(ids)
+
+def union(a, b):
+    return getBackend().union(a, b)
+
+def intersection(a, b):
+    return getBackend().intersection(a, b)
+
+def difference(a, b):
+    return getBackend().difference(a, b)
+
+## the page IDs in a set, as a list of ints. with numpy, they are in ascending order.
+def toList(s):
+    return getBackend().toList(s)
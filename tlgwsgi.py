@@ -9,8 +9,10 @@ import gettext
 import csv
 import threading
 import traceback
+import __builtin__
 import tlgbackend
 import tlgflaws
+import tlgmetrics
 from utils import *
 
 
@@ -53,7 +55,7 @@ def parseCGIargs(environ):
     from urllib import unquote
     from urlparse import parse_qs
     params= {}
-    if 'CONTENT_LENGTH' in environ and int(environ['CONTENT_LENGTH'])!=0:
+    if environ.get('CONTENT_LENGTH') and int(environ['CONTENT_LENGTH'])!=0:     # wsgiref passes an empty string for GET requests
         #~ dprint(0, "POST request, content length %s" % environ['CONTENT_LENGTH'])
         request_body= environ['wsgi.input'].read(int(environ['CONTENT_LENGTH']))
         if len(request_body)!=0:
@@ -177,7 +179,7 @@ function setStatus(text, percentage) { document.getElementById("thestatus").inne
         if tlg.getActiveWorkerCount()<1: return ''
         r= '<div style=\\"text-align: left; position: absolute; top: 34px; left: 0px; white-space: pre; font-size: 9.5px;\\">Threads:<br>'
         i= 0
-        for t in tlg.workerThreads:
+        for t in tlg.getWorkerThreads():
             r+= "%2d: %s<br>" % (i, t.getCurrentAction())
             i+= 1
         return r + '</div>'
@@ -340,6 +342,7 @@ def makeHelpPage():
     helptext= """TLG backend parameters:<pre>
 * action
     * action=listflaws -- list available flaw filters
+    * action=metrics -- counters and latency histograms of this process in the prometheus text format (server mode only, see --fcgi and --http)
     * action=query -- query CatGraph for categories and filter articles
         * lang=&lt;string> -- wiki language code ('de', 'en').
             graphcore instances are currently running for <a href="http://""" + ('ortelius.toolserver.org' if TOOLSERVER else 'sylvester.wmflabs.org') \
@@ -363,7 +366,23 @@ def makeHelpPage():
                     entry from the <a href="http://www.mediawiki.org/wiki/Page_table">page table</a>.
             * wikitext - this format can be used to copy to user pages or similar.
             * csv - tabbed csv format.
+        * maxresults=&lt;integer> -- only return the best N pages. only the best N pages are kept in memory while the query is running.
+        * stream=&lt;string> -- yield results while the query is running, unsorted. possible values are
+            * merged - yield each page as soon as all filters have tested it
+            * unsorted - yield each filter result as soon as it is found. pages found by more than one filter are listed once per filter.
+        * cache=false -- run the query even if the result of the same query is cached. 
+          results are cached for some minutes, repeated queries with other output formats or maxresults are served from the cache.
+          some filters also remember their verdicts for each page revision and only test pages which were edited since; 
+          with cache=false, all pages are tested again.
+        * timing=true -- add a line {"timing": {...}} at the end, with the time spent in each stage of the query, 
+          and per filter the number of actions, time spent waiting and executing, SQL queries and rows, and cache hits.
 * i18n=&lt;language code> -- select output language ('de', 'en')
+* workers=&lt;integer> -- maximum number of worker threads testing pages for this query at the same time (default 10). numthreads is an alias.
+* executor=&lt;string> -- how CPU-bound stages like encoding the results are run. possible values are
+    * inline - in the thread handling the request (default)
+    * thread - in a thread pool
+    * process - in a pool of worker processes, one per CPU core at most
+* asyncconnections=&lt;integer> -- if not 0, filters which support it send their queries from one thread, using at most this many connections per database server.
 * chunked=true -- if specified, use chunked transfer encoding. for creating dynamic progress bars and the like.
 * showthreads=true -- debug output; show what threads are doing. use with format=html + chunked=true.
 </pre>""";
@@ -378,8 +397,21 @@ def makeHelpPage():
     
     
 
+## get the translation for a language. 
+# translations are kept, so that the message catalogs are not parsed again for each request in server mode.
+translations= {}
+def getTranslation(i18n):
+    if not i18n in translations:
+        translations[i18n]= gettext.translation('tlgbackend', localedir= os.path.join(sys.path[0], 'messages'), languages=[i18n])
+    return translations[i18n]
+
+# messages are translated into the language of the request handled by the calling thread, see RequestContext.
+__builtin__._= translate
+
 ############## wsgi generator function
 def generator_app(environ, start_response):
+    # in server mode, the threads handle one request after the other, the messages of each request are logged with their own ID
+    requestContext.requestID= makeRequestID()
     dprint(1, "generator_app")
 
     try:
@@ -389,6 +421,11 @@ def generator_app(environ, start_response):
             start_response('200 OK', [('Content-Type', 'text/html; charset=utf-8')])
             return makeHelpPage()
         
+        # process-wide metrics in the prometheus text format, cheap enough to be scraped often
+        if getParam(params, 'action', None)=='metrics':
+            start_response('200 OK', [('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')])
+            return [ tlgmetrics.render() ]
+        
         mailto= getParam(params, 'mailto', None)
         chunked= getBoolParam(params, 'chunked', False) and not bool(mailto)
         showThreads= getBoolParam(params, 'showthreads', False) and not bool(mailto)
@@ -398,23 +435,23 @@ def generator_app(environ, start_response):
         i18n= getParam(params, 'i18n', 'de')
         wikipage= getParam(params, 'wikipage', None)
         if wikipage: format= 'wikitext' # writing to wiki page implies wikitext format
-        global testrun
         testrun= getBoolParam(params, 'test', False)
+        enableTestrun(testrun)
         dprint(0, "testrun: %s" % str(testrun))
-        numThreads= getParam(params, 'numthreads', 10)
-        maxresults= int(getParam(params, 'maxresults', 0))  # this only works for csv and possibly wikitext
+        numWorkers= getParam(params, 'workers', getParam(params, 'numthreads', 10))
+        executor= getParam(params, 'executor', 'inline')
+        asyncConnections= getParam(params, 'asyncconnections', 0)
+        maxresults= int(getParam(params, 'maxresults', 0))
         
         #~ logStats({'environment': str(environ)})
         #~ if 'daemon' in environ:
             #~ logStats({'bgprocessparams': str(params)})
 
         try:
-            gettext.translation('tlgbackend', localedir= os.path.join(sys.path[0], 'messages'), languages=[i18n]).install()
+            requestContext.translation= getTranslation(i18n)
         except:
             # fall back to untranslated strings
-            def ident(msg): return msg
-            global _
-            _= ident
+            requestContext.translation= None
         
         if mailto or wikipage:
             if 'daemon' in environ and environ['daemon']=='True':
@@ -438,7 +475,7 @@ def generator_app(environ, start_response):
                 start_response('200 OK', [('Content-Type', 'text/plain; charset=utf-8')])
                 return ( '{ "status": "background process started" }', )
         
-        tlg= tlgbackend.TaskListGenerator(numthreads= numThreads, testrun_= testrun)
+        tlg= tlgbackend.TaskListGenerator(workers= numWorkers, testrun_= testrun, executor= executor, asyncConnections= asyncConnections)
         
         if action=='query':
             lang= getParam(params, 'lang')
@@ -446,9 +483,12 @@ def generator_app(environ, start_response):
             queryDepth= getParam(params, 'querydepth', 1)
             flaws= getParam(params, 'flaws')
             include_hidden= getBoolParam(params, 'include_hidden', False)
+            streaming= getParam(params, 'stream', None)
+            timing= getBoolParam(params, 'timing', False)
+            useCache= getBoolParam(params, 'cache', True)
             if lang is None or queryString is None or flaws is None:
                 raise InputValidationError("parameters lang, query, and flaws must be given")
-            tlgResult= tlg.generateQuery(lang=lang, queryString=queryString, queryDepth=queryDepth, flaws=flaws, include_hidden=include_hidden)
+            tlgResult= tlg.generateQuery(lang=lang, queryString=queryString, queryDepth=queryDepth, flaws=flaws, include_hidden=include_hidden, streaming=streaming, maxresults=maxresults, timing=timing, useCache=useCache)
         elif action=='listflaws':
             tlgResult= (tlg.getFlawList(),)
         elif action=='markasdone':
@@ -515,6 +555,37 @@ def generator_app(environ, start_response):
         return [ '{"exception": "%s"}' % (traceback.format_exc(info[2]).replace('\n', '\\n').replace('"', '\\"')) ]
 
 
+## load the filter modules and start the worker pool before the first request comes in.
+def warmUp(i18n= 'de'):
+    getTranslation(i18n)
+    tlgbackend.TaskListGenerator.loadFilterModules()
+    tlgbackend.WorkerPool.get()
+
+## run a server which handles requests in this process, keeping filter modules, caches, connections and worker threads between requests.
+# @param mode 'fcgi' for a FastCGI server, 'http' for a standalone HTTP server.
+# @param address for fcgi, a unix socket path or host:port to listen on. if None, the socket passed by the web server is used.
+#                for http, [host:]port to listen on, default port is 8000.
+def runServer(mode, address= None):
+    warmUp()
+    if mode=='fcgi':
+        from flup.server.fcgi import WSGIServer
+        if address!=None and ':' in address:
+            host, port= address.rsplit(':', 1)
+            address= (host, int(port))
+        dprint(0, 'starting FastCGI server on %s' % str(address or 'web server socket'))
+        WSGIServer(generator_app, bindAddress= address).run()
+    else:
+        import SocketServer
+        from wsgiref.simple_server import make_server, WSGIServer
+        class ThreadingWSGIServer(SocketServer.ThreadingMixIn, WSGIServer):
+            daemon_threads= True
+        host, port= '', 8000
+        if address!=None:
+            if ':' in address: host, port= address.rsplit(':', 1)
+            else: port= address
+        dprint(0, 'starting HTTP server on %s:%s' % (host, port))
+        make_server(host, int(port), generator_app, server_class= ThreadingWSGIServer).serve_forever()
+
 
 if __name__ == "__main__":
     getRequestID()
@@ -536,9 +607,11 @@ if __name__ == "__main__":
         #~ os.environ['QUERY_STRING']= 'action=query&format=wikitext&lang=de&query=Sport&querydepth=2&flaws=Small'
     #~ dprint(str(os.environ))
 
-    # change this to "flup.server.fcgi" when/if fcgid is installed on the toolserver
-    #~ from flup.server.fcgi import WSGIServer
-    from flup.server.cgi import WSGIServer
-    WSGIServer(generator_app).run()
+    if len(sys.argv)>1 and sys.argv[1] in ('--fcgi', '--http'):
+        runServer(sys.argv[1][2:], sys.argv[2] if len(sys.argv)>2 else None)
+    else:
+        # one process per request
+        from flup.server.cgi import WSGIServer
+        WSGIServer(generator_app).run()
     dprint(1, "__main__ exiting")
 
@@ -5,15 +5,35 @@ import os
 import sys
 import pwd
 import time
-import sqlite3
-import MySQLdb
-import MySQLdb.cursors 
 import threading
+import functools
+import importlib
+import collections
+import atexit
 import getpass
 import json
 import uuid
+import select
+import tlgmetrics
 
-from beaker.cache import cache_region, cache_regions
+
+## a module which is imported when one of its attributes is used for the first time, to keep heavy imports out of startup.
+class LazyModule(object):
+    def __init__(self, name, *submodules):
+        self._name= name
+        self._submodules= submodules
+        self._module= None
+    
+    def __getattr__(self, attr):
+        if self._module==None:
+            module= importlib.import_module(self._name)
+            for submodule in self._submodules:
+                importlib.import_module('%s.%s' % (self._name, submodule))
+            self._module= module
+        return getattr(self._module, attr)
+
+MySQLdb= LazyModule('MySQLdb', 'cursors')
+sqlite3= LazyModule('sqlite3')
 
 TOOLSERVER= False   #todo: autodetect
 
@@ -21,6 +41,16 @@ if TOOLSERVER:
     config= { 
         'graphserv-host': 'ortelius',
         'graphserv-port': '6666',
+        # per database server, see ConnectionPool. worker threads, query threads and the AsyncExecutor (asyncconnections, usually 4)
+        # all take their connections from the pool and may hold one while acquiring another, so this must be at least
+        # worker-threads + query-threads + asyncconnections, or nested acquires wait and fail with error 1203.
+        'mysql-max-connections': 22,
+        'worker-threads': 10,           # size of the WorkerPool
+        'query-threads': 8,             # max. number of query string tokens evaluated at the same time
+        'log-level': 2,                 # messages up to this level are written to log.db, see dprint()
+        'log-buffer-size': 10000,       # messages kept in memory until the LogWriter writes them
+        'result-cache-ttl': 15*60,      # seconds query results are kept in the ResultCache, 0 to disable it
+        'verdict-cache-ttl': 7*24*60*60,    # seconds filter verdicts are kept in the VerdictCache, 0 to disable it
     }
 
     DATADIR= '/mnt/user-store/%s/tlgbackend/tip' % getpass.getuser()
@@ -28,20 +58,48 @@ else:
     config= { 
         'graphserv-host': 'sylvester',
         'graphserv-port': '6666',
+        # per database server, see ConnectionPool. worker threads, query threads and the AsyncExecutor (asyncconnections, usually 4)
+        # all take their connections from the pool and may hold one while acquiring another, so this must be at least
+        # worker-threads + query-threads + asyncconnections, or nested acquires wait and fail with error 1203.
+        'mysql-max-connections': 22,
+        'worker-threads': 10,           # size of the WorkerPool
+        'query-threads': 8,             # max. number of query string tokens evaluated at the same time
+        'log-level': 2,                 # messages up to this level are written to log.db, see dprint()
+        'log-buffer-size': 10000,       # messages kept in memory until the LogWriter writes them
+        'result-cache-ttl': 15*60,      # seconds query results are kept in the ResultCache, 0 to disable it
+        'verdict-cache-ttl': 7*24*60*60,    # seconds filter verdicts are kept in the VerdictCache, 0 to disable it
     }
 
     DATADIR= os.path.expanduser('~/tlgbackend')
     
 beakerCacheDir= os.path.join(DATADIR, 'beaker-cache')
 
-#~ if not 'testrun' in globals():
-testrun= False
+## settings of the request the current thread works for. the threaded http server handles several requests at the same time,
+#  so these can't be process globals. threads working for a request (worker threads, token threads) take them over with set().
+class RequestContext(threading.local):
+    translation= None   # gettext translation of the request language, None for untranslated messages
+    testrun= False
+    requestID= None     # the key the messages of the request are logged with, see getRequestID()
+    
+    def get(self):
+        return (self.translation, self.testrun, self.requestID)
+    
+    def set(self, settings):
+        (self.translation, self.testrun, self.requestID)= settings
+
+requestContext= RequestContext()
+
+## translate a message into the language of the current request. tlgwsgi installs this as _().
+def translate(message):
+    translation= requestContext.translation
+    if translation==None or not message:
+        return message
+    return translation.gettext(message)
 
-def enableTestrun():
-    global testrun
-    testrun= True   # oh my god, the pain...
+def enableTestrun(enable= True):
+    requestContext.testrun= enable
 
-cache_regions.update({
+beakerCacheRegions= {
     'mem1h': {          # cache 1 hour in memory, e. g. page ID results
         'expire': 60*60,
         'type': 'memory',
@@ -59,7 +117,39 @@ cache_regions.update({
         'data_dir': beakerCacheDir,
         'key_length': '250'
     }
-})
+}
+
+## like beaker.cache.cache_region, but beaker is imported when the decorated function is called for the first time.
+def cache_region(region, *args):
+    def decorate(func):
+        cached= []
+        @functools.wraps(func)
+        def wrapper(*funcArgs):
+            if not cached:
+                import beaker.cache
+                for name in beakerCacheRegions:
+                    beaker.cache.cache_regions.setdefault(name, beakerCacheRegions[name])
+                cached.append(beaker.cache.cache_region(region, *args)(func))
+            return cached[0](*funcArgs)
+        return wrapper
+    return decorate
+
+## run a function in a daemon thread, e. g. to clean up old files without delaying startup.
+#  if interval is given, the function is run again every interval seconds.
+def runInBackground(function, interval= None):
+    def run():
+        while True:
+            try:
+                function()
+            except Exception as e:
+                dprint(0, 'background task %s failed: %s' % (function.__name__, str(e)))
+            if interval==None:
+                return
+            time.sleep(interval)
+    thread= threading.Thread(target= run, name= 'background-%s' % function.__name__)
+    thread.daemon= True
+    thread.start()
+    return thread
 
 NS_MAIN = 0
 NS_TALK = 1
@@ -78,6 +168,10 @@ NS_HELP_TALK = 13
 NS_CATEGORY = 14
 NS_CATEGORY_TALK = 15
 
+# page table columns which are passed on in results
+pageColumns= ('page_id', 'page_namespace', 'page_title', 'page_restrictions', 'page_counter', 'page_is_redirect', 
+    'page_is_new', 'page_random', 'page_touched', 'page_latest', 'page_len')
+
 
 class InputValidationError(RuntimeError):
     pass
@@ -85,80 +179,273 @@ class InputValidationError(RuntimeError):
 def GetSQLDefaultFile():
     return os.path.expanduser('~')+"/.my.cnf" if TOOLSERVER else os.path.expanduser('~')+"/replica.my.cnf"
 
-def GetTempCursors():
+def CachedThreadValue(name, getValue):
     t= threading.currentThread()
     try:
         t.cache
     except AttributeError:
         t.cache= dict()
     try:
-        return t.cache['tempcursors']
+        return t.cache[name]
     except KeyError:
-        t.cache['tempcursors']= dict()
-        return t.cache['tempcursors']
+        t.cache[name]= getValue()
+    return t.cache[name]
 
-## a temporary cursor to be used with the 'with' statement. will pe cached per thread and automatically cleaned up.
+class DictCache(dict):
+    def __init__(self):
+        dict.__init__(self)
+    def __missing__(self, key):
+        newvalue= self.createEntry(key)
+        self.__setitem__(key, newvalue)
+        return newvalue
+    def createEntry(self, key):
+        raise NotImplementedError("createEntry must be reimplemented in subclasses")
+
+## per-thread counters of database and catgraph calls and page cache lookups.
+#  the time spent in an action is measured by taking the difference of the counters before and after it, see QueryStats.
+class ThreadCounters(threading.local):
+    fields= ('sqlQueries', 'sqlSeconds', 'sqlRows', 'catgraphCalls', 'catgraphSeconds', 'pageCacheHits', 'pageCacheMisses')
+    
+    def __init__(self):
+        for field in self.fields:
+            setattr(self, field, 0)
+    
+    def snapshot(self):
+        return dict( (field, getattr(self, field)) for field in self.fields )
+    
+    ## the counters of this thread since snapshot() was called.
+    def since(self, snapshot):
+        return dict( (field, getattr(self, field)-snapshot[field]) for field in self.fields )
+    
+    ## add counters of work done in another thread on behalf of this one.
+    def add(self, delta):
+        for field in delta:
+            setattr(self, field, getattr(self, field)+delta[field])
+
+threadCounters= ThreadCounters()
+
+## add the counters in 'delta' to 'counters'.
+def addCounters(counters, delta):
+    for field in delta:
+        counters[field]= counters.get(field, 0) + delta[field]
+
+## a database cursor which counts queries, rows fetched and the time spent in execute() in threadCounters.
+class TimedCursor(object):
+    __slots__= ('cursor',)
+    
+    def __init__(self, cursor):
+        self.cursor= cursor
+    
+    def execute(self, *args):
+        begin= time.time()
+        try:
+            return self.cursor.execute(*args)
+        finally:
+            seconds= time.time()-begin
+            threadCounters.sqlQueries+= 1
+            threadCounters.sqlSeconds+= seconds
+            tlgmetrics.sqlDuration.observe(seconds)
+    
+    def fetchall(self):
+        rows= self.cursor.fetchall()
+        threadCounters.sqlRows+= len(rows)
+        tlgmetrics.sqlRowsTotal.inc(len(rows))
+        return rows
+    
+    def fetchone(self):
+        row= self.cursor.fetchone()
+        if row!=None: 
+            threadCounters.sqlRows+= 1
+            tlgmetrics.sqlRowsTotal.inc()
+        return row
+    
+    def __iter__(self):
+        return iter(self.fetchall())
+    
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+## a connection from the ConnectionPool. remembers the database it is using.
+class PooledConnection:
+    def __init__(self, host, conn):
+        self.host= host
+        self.conn= conn
+        self.db= None
+        self.lastUse= time.time()
+    
+    def selectDB(self, db):
+        if self.db!=db:
+            self.conn.select_db(db)
+            self.db= db
+
+## a bounded, thread-safe pool of database connections, shared by all threads.
+#  idle connections which already use the requested database are preferred, so that no 'USE' is needed.
+#  idle connections are pinged before they are handed out again, and closed after maxIdleTime seconds.
+#  at most config['mysql-max-connections'] connections per server are open at the same time, to stay below max_user_connections. 
+#  acquire() waits for a connection to be released when the limit is reached, unless it is told not to block.
+#  threads may hold a connection while acquiring another one, so the limit has to cover all threads using the pool, see config.
+class ConnectionPool:
+    maxIdleTime= 60         # seconds after which idle connections are closed
+    pingTime= 5             # connections which were idle for more seconds than this are pinged before use
+    waitTimeout= 60         # seconds to wait for a connection when the limit is reached
+    condition= threading.Condition()
+    idle= {}                # host => list of idle PooledConnections, least recently used first
+    numOpen= {}             # host => number of open connections, including connections being opened
+    
+    ## create a new database connection. can be replaced, e. g. to connect to a test database.
+    # autocommit is enabled: otherwise the transaction opened by the first query would stay open while the connection is in the pool,
+    # and later queries would read from its old REPEATABLE READ snapshot.
+    @staticmethod
+    def connect(host):
+        conn= MySQLdb.connect( read_default_file=GetSQLDefaultFile(), host=host, use_unicode=False, cursorclass=MySQLdb.cursors.DictCursor )
+        conn.autocommit(True)
+        return conn
+    
+    ## get a connection to a server, using database 'db' if given. 
+    #  the connection must be given back with release(), or with discard() if it is broken.
+    #  @param block if False, None is returned instead of waiting when the limit is reached.
+    @staticmethod
+    def acquire(host, db= None, block= True):
+        pool= ConnectionPool
+        deadline= time.time() + pool.waitTimeout
+        pooled= None
+        with pool.condition:
+            while True:
+                pool.evictIdle()
+                idle= pool.idle.setdefault(host, [])
+                if idle:
+                    sameDB= [ i for i in xrange(len(idle)) if idle[i].db==db ]
+                    pooled= idle.pop(sameDB[-1] if sameDB else -1)
+                    break
+                if pool.numOpen.get(host, 0) < int(config['mysql-max-connections']):
+                    pool.numOpen[host]= pool.numOpen.get(host, 0) + 1
+                    break
+                if not block:
+                    return None
+                timeout= deadline - time.time()
+                if timeout<=0:
+                    raise MySQLdb.OperationalError(1203, 'no free connection to %s in the connection pool after %d seconds (%d connections open)' % (host, pool.waitTimeout, pool.numOpen[host]))
+                pool.condition.wait(timeout)
+        # connect outside of the lock
+        try:
+            if pooled==None:
+                pooled= PooledConnection(host, pool.connect(host))
+            elif time.time()-pooled.lastUse > pool.pingTime:
+                try:
+                    pooled.conn.ping()
+                except MySQLdb.Error:
+                    dprint(1, 'pooled connection to %s is broken, reconnecting' % host)
+                    pool.close(pooled)
+                    pooled= PooledConnection(host, pool.connect(host))
+            if db!=None:
+                pooled.selectDB(db)
+        except:
+            if pooled!=None: pool.close(pooled)
+            with pool.condition:
+                pool.numOpen[host]-= 1
+                pool.condition.notify()
+            raise
+        return pooled
+    
+    ## give back a connection acquired from the pool.
+    @staticmethod
+    def release(pooled):
+        pool= ConnectionPool
+        with pool.condition:
+            pooled.lastUse= time.time()
+            pool.idle[pooled.host].append(pooled)
+            pool.condition.notify()
+    
+    ## close a connection acquired from the pool instead of giving it back, e. g. after a connection error.
+    @staticmethod
+    def discard(pooled):
+        pool= ConnectionPool
+        pool.close(pooled)
+        with pool.condition:
+            pool.numOpen[pooled.host]-= 1
+            pool.condition.notify()
+    
+    ## close idle connections which were not used for maxIdleTime seconds. must be called with the condition locked.
+    @staticmethod
+    def evictIdle():
+        pool= ConnectionPool
+        expired= time.time() - pool.maxIdleTime
+        for host in pool.idle:
+            idle= pool.idle[host]
+            while idle and idle[0].lastUse < expired:
+                pool.close(idle.pop(0))
+                pool.numOpen[host]-= 1
+    
+    @staticmethod
+    def close(pooled):
+        try:
+            pooled.conn.close()
+        except MySQLdb.Error:
+            pass
+
+tlgmetrics.Gauge('tlg_mysql_connections_open', 'Open connections in the ConnectionPool, by server.', ('host',),
+    function= lambda: dict( ((host,), n) for host, n in ConnectionPool.numOpen.items() ))
+tlgmetrics.Gauge('tlg_mysql_connections_idle', 'Idle connections in the ConnectionPool, by server.', ('host',),
+    function= lambda: dict( ((host,), len(idle)) for host, idle in ConnectionPool.idle.items() ))
+
+## a temporary cursor to be used with the 'with' statement. the connection is taken from the ConnectionPool and given back afterwards.
 class TempCursor:
     def __init__(self, host, dbname):
         self.host= host
         self.dbname= dbname
-        self.key= '%s.%s' % (host,dbname)
     
     def __enter__(self):
-        if self.key in GetTempCursors(): 
-            return GetTempCursors()[self.key].cursor
-        
-        self.conn= None
-        while self.conn==None:
-            try:
-                self.conn= MySQLdb.connect( read_default_file=GetSQLDefaultFile(), host=self.host, \
-                    use_unicode=False, cursorclass=MySQLdb.cursors.DictCursor )
-            except MySQLdb.OperationalError as e:
-                if 'max_user_connections' in str(e):
-                    dprint(0, str(e))
-                    #~ dprint(0, 'exceeded max connections, retrying...')
-                    #~ time.sleep(0.5)
-                    raise   #xxxxx
-                else:
-                    raise
-        
-        self.cursor= self.conn.cursor()
-        self.cursor.execute ("USE %s" % self.conn.escape_string(self.dbname))
-        GetTempCursors()[self.key]= self
+        self.conn= ConnectionPool.acquire(self.host, self.dbname)
+        self.cursor= TimedCursor(self.conn.conn.cursor())
         return self.cursor
 
     def __exit__(self, exc_type, exc_value, traceback):
-        GetTempCursors()[self.key].lastuse= time.time()
+        self.cursor.close()
+        if isinstance(exc_value, MySQLdb.OperationalError): ConnectionPool.discard(self.conn)
+        else: ConnectionPool.release(self.conn)
+
 
+## cursors of a thread, one per wiki database. the connections are taken from the ConnectionPool.
+class Cursors(DictCache):
+    def __init__(self):
+        DictCache.__init__(self)
+        self.connections= []
+    
+    def createEntry(self, key):
+        conn= ConnectionPool.acquire(getDBHost(key), key)
+        self.connections.append(conn)
+        return TimedCursor(conn.conn.cursor())
+    
+    ## close the cursors and give the connections back to the pool.
+    def release(self):
+        for cursor in self.itervalues():
+            cursor.close()
+        self.clear()
+        for conn in self.connections:
+            ConnectionPool.release(conn)
+        self.connections= []
 
 ## get cursor for a wikipedia database ('enwiki_p' etc).
-#  cursors are created on demand and stored locally for each thread.
+#  cursors are created on demand and stored locally for each thread, until the thread calls releaseCursors().
 #  the DictCursor class is used, i. e. you get dicts with the column names as keys in query results.
 def getCursors():
-    class Cursors(DictCache):
-        def createEntry(self, key):
-            if TOOLSERVER:
-                if key in getWikiServerMap(): ckey= getWikiServerMap()[key]
-                else: ckey= 'sql' # guess
-            else:
-                ckey= '%s.labsdb' % (key.split('_p')[0])
-            conn= None
-            while conn==None:
-                try:
-                    conn= getConnections()[ckey]
-                except MySQLdb.OperationalError as e:
-                    if 'max_user_connections' in str(e):
-                        dprint(0, str(e))
-                        #~ dprint(0, 'exceeded max connections, retrying...')
-                        #~ time.sleep(0.5)
-                        raise   #xxxxx
-                    else:
-                        raise
-            cur= conn.cursor()
-            cur.execute ("USE %s" % conn.escape_string(key))
-            return cur
     return CachedThreadValue('SQLCursors', Cursors)
 
+## give the connections of the current thread's cursors back to the ConnectionPool. 
+#  called by worker threads after each action, so that the threads share the connections.
+def releaseCursors():
+    cache= getattr(threading.currentThread(), 'cache', {})
+    if isinstance(cache.get('SQLCursors'), Cursors):
+        cache.pop('SQLCursors').release()
+
+## get the database server for a wikipedia database ('enwiki_p' etc).
+def getDBHost(wiki):
+    if TOOLSERVER:
+        if wiki in getWikiServerMap(): return getWikiServerMap()[wiki]
+        else: return 'sql' # guess
+    else:
+        return '%s.labsdb' % (wiki.split('_p')[0])
+
 ## get page entries matching a given page_title and optional namespace.
 #  returns a tuple of dicts containing the result rows, or a tuple with length 0 if not found.
 #  @param wiki wiki database name
@@ -176,12 +463,68 @@ def getPageByTitle(wiki, pageTitle, pageNamespace=None):
     return cur.fetchall()
 
 ## get a page entry given its page_id.
-#  returns a tuple of dicts containing the result row, or a tuple with length 0 if not found.
-@cache_region('mem1h', 'pageIDs')
+#  returns a tuple of dicts containing the pageColumns of the row, or a tuple with length 0 if not found.
+#  the rows are copies, callers may modify them.
 def getPageByID(wiki, pageID):
+    values= PageRowCache.get(wiki, pageID)
+    if values!=None:
+        threadCounters.pageCacheHits+= 1
+        tlgmetrics.pageRowCacheTotal.inc(labels= ('hit',))
+        return (dict(zip(pageColumns, values)),)
+    threadCounters.pageCacheMisses+= 1
+    tlgmetrics.pageRowCacheTotal.inc(labels= ('miss',))
     cur= getCursors()[wiki]
-    cur.execute("SELECT * FROM page WHERE page_id = %s", (pageID,))
-    return cur.fetchall()
+    cur.execute("SELECT %s FROM page WHERE page_id = %%s" % ', '.join(pageColumns), (pageID,))
+    rows= cur.fetchall()
+    PageRowCache.update(wiki, rows)
+    return rows
+
+## split a sequence into chunks of at most 'size' elements.
+def chunks(coll, size):
+    return [ coll[i:i+size] for i in range(0, len(coll), size) ]
+
+## in-memory cache for page table rows, keyed by wiki and page_id, for getPageByID(). 
+#  only the pageColumns of the rows are kept, as tuples. refreshed by getPagesByIDs(), which always queries the database.
+class PageRowCache:
+    lifetime= 60*60     # seconds
+    maxRows= 500000     # expired rows are purged when the cache grows beyond this
+    rows= dict()        # (wiki, page_id) => (expiry time, tuple of values in the order of pageColumns)
+    lock= threading.Lock()
+    
+    @staticmethod
+    def get(wiki, pageID):
+        entry= PageRowCache.rows.get((wiki, pageID))
+        if entry!=None and entry[0]>time.time():
+            return entry[1]
+        return None
+    
+    @staticmethod
+    def update(wiki, rows):
+        expires= time.time() + PageRowCache.lifetime
+        with PageRowCache.lock:
+            if len(PageRowCache.rows) > PageRowCache.maxRows:
+                now= time.time()
+                for key in [ k for k, v in PageRowCache.rows.iteritems() if v[0]<=now ]:
+                    del PageRowCache.rows[key]
+                if len(PageRowCache.rows) > PageRowCache.maxRows:
+                    PageRowCache.rows.clear()
+            for row in rows:
+                PageRowCache.rows[(wiki, row['page_id'])]= (expires, tuple([ row.get(column) for column in pageColumns ]))
+
+## get page entries for a list of page_ids, with chunked 'IN (...)' queries.
+#  the rows are always fetched from the database, as filters depend on e. g. page_latest being current. 
+#  returns a dict page_id => row with the pageColumns. page IDs which were not found are missing in the result.
+def getPagesByIDs(wiki, pageIDs, chunkSize= 500):
+    result= {}
+    cur= getCursors()[wiki]
+    for chunk in chunks(pageIDs, chunkSize):
+        format_strings= ','.join(['%s'] * len(chunk))
+        cur.execute("SELECT %s FROM page WHERE page_id IN (%s)" % (', '.join(pageColumns), format_strings), chunk)
+        rows= cur.fetchall()
+        PageRowCache.update(wiki, rows)
+        for row in rows:
+            result[row['page_id']]= row
+    return result
 
 ## find a category ID given its title.
 #  returns category ID, or None if not found.
@@ -220,46 +563,165 @@ def getUsername():
     return pwd.getpwuid( os.getuid() )[ 0 ]
 
 # logging to files makes filtering hard, logging to sql server is impractical too (what if we want to log an sql connection failure?), so we use sqlite.
-def logToDB(timestamp, level, requestID, *args):
-    def createLogCursor():
-        conn= sqlite3.connect(os.path.join(DATADIR, "log.db"), isolation_level= None, timeout= 30.0)
-        logCursor= conn.cursor()
+# log messages are collected in a ring buffer and written by a background thread, one transaction per batch,
+# so that logging threads never wait for the sqlite lock.
+class LogWriter(threading.Thread):
+    ## @param bufferSize maximum number of messages waiting to be written. when the buffer is full, the oldest messages are dropped.
+    # @param interval maximum time in seconds a message waits to be written.
+    def __init__(self, bufferSize, interval= 1.0):
+        threading.Thread.__init__(self, name= 'LogWriter')
+        self.daemon= True
+        self.buffer= collections.deque(maxlen= bufferSize)
+        self.interval= interval
+        self.batchSize= max(1, bufferSize/2)
+        self.condition= threading.Condition()
+        self.pid= os.getpid()
+        self.numDropped= 0
+        self.stopped= False
+        self.deadline= None         # when the oldest message in the buffer has to be written
+        self.wakeup= os.pipe()      # put() and stop() write to this to end the sleep in run() early
+
+    ## add a log entry, (timestamp, level, message, requestID).
+    def put(self, entry):
+        with self.condition:
+            if len(self.buffer)==self.buffer.maxlen:
+                self.numDropped+= 1
+            elif not self.buffer:
+                self.deadline= time.time() + self.interval
+                self.condition.notify()
+            self.buffer.append(entry)
+            if len(self.buffer)==self.batchSize:
+                self.wakeUp()
+    
+    def wakeUp(self):
+        os.write(self.wakeup[1], 'x')
+    
+    ## sleep until the oldest message in the buffer is due, or until a batch is full or the writer is stopped.
+    # select() is used, as waiting on a condition with a timeout polls in python 2.
+    def sleep(self):
+        with self.condition:
+            if self.stopped or len(self.buffer)>=self.batchSize:
+                return
+            timeout= self.deadline - time.time()
+        if timeout>0:
+            readable, writable, exceptional= select.select([self.wakeup[0]], [], [], timeout)
+            if readable:
+                os.read(self.wakeup[0], 4096)
+
+    def connect(self):
+        conn= sqlite3.connect(os.path.join(DATADIR, "log.db"), timeout= 30.0)
         try:
-            logCursor.execute('CREATE TABLE logs(timestamp VARBINARY, level INTEGER, message VARBINARY, requestID CHARACTER)')
-            logCursor.execute('CREATE INDEX timestamp ON logs (timestamp)')
-            logCursor.execute('CREATE INDEX requestID ON logs (requestID)')
+            conn.execute('CREATE TABLE logs(timestamp VARBINARY, level INTEGER, message VARBINARY, requestID CHARACTER)')
+            conn.execute('CREATE INDEX timestamp ON logs (timestamp)')
+            conn.execute('CREATE INDEX requestID ON logs (requestID)')
+            conn.commit()
         except sqlite3.OperationalError:
             pass    # table exists
-        if threading.currentThread().name == 'MainThread':
-            logCursor.execute('DELETE FROM logs WHERE timestamp < ?', (MakeTimestamp(time.time() - 60*60*24*30*3),) )  # remove logs older than 3 months
-        return logCursor
-    try:
-        logCursor= CachedThreadValue('logCursor', createLogCursor)
-        logCursor.execute('INSERT INTO logs VALUES (?, ?, ?, ?)', (timestamp, level, unicode(str(*args).decode('utf-8')), requestID))
-    except sqlite3.OperationalError:
-        pass
+        return conn
+
+    def run(self):
+        conn= None
+        lastError= None
+        while True:
+            with self.condition:
+                while not (self.stopped or self.buffer):
+                    self.condition.wait()
+            self.sleep()
+            with self.condition:
+                entries= list(self.buffer)
+                self.buffer.clear()
+                numDropped= self.numDropped
+                self.numDropped= 0
+                stopped= self.stopped
+            if numDropped:
+                entries.append( (MakeTimestamp(), 0, 'LogWriter: buffer full, %d messages dropped' % numDropped, getRequestID()) )
+            try:
+                if entries:
+                    if conn==None:
+                        conn= self.connect()
+                        if self.pid==mainProcessID:
+                            pruneLogs(conn)
+                    with conn:
+                        conn.executemany('INSERT INTO logs VALUES (?, ?, ?, ?)', 
+                            [ (timestamp, level, toUnicode(message), requestID) for timestamp, level, message, requestID in entries ])
+                    lastError= None
+            except sqlite3.Error as e:
+                # report each error once, the log database may be unavailable for a long time
+                if str(e)!=lastError:
+                    sys.stderr.write('[%s] LogWriter: %s, messages are lost\n' % (MakeTimestamp(), str(e)))
+                    lastError= str(e)
+                conn= None
+            if stopped:
+                return
+
+    ## write the remaining messages and stop the thread.
+    def stop(self):
+        with self.condition:
+            self.stopped= True
+            self.condition.notify()
+        self.wakeUp()
+        self.join(10)
+
+def toUnicode(message):
+    if isinstance(message, unicode):
+        return message
+    return str(message).decode('utf-8', 'replace')
+
+## remove logs older than 3 months.
+def pruneLogs(conn):
+    with conn:
+        conn.execute('DELETE FROM logs WHERE timestamp < ?', (MakeTimestamp(time.time() - 60*60*24*30*3),) )
+
+mainProcessID= os.getpid()
+logWriter= None
+logWriterLock= threading.Lock()
+
+## returns the log writer of this process. a forked process (e. g. with the 'process' executor) starts its own.
+def getLogWriter():
+    global logWriter
+    with logWriterLock:
+        if logWriter==None or logWriter.pid!=os.getpid():
+            logWriter= LogWriter(config['log-buffer-size'])
+            logWriter.start()
+            atexit.register(logWriter.stop)
+        return logWriter
+
+def logToDB(timestamp, level, requestID, message):
+    getLogWriter().put( (timestamp, level, message, requestID) )
 
-# this returns a per-process key for logging.
-# make sure this is called at least once in the main thread before any child thread logs anything.
 # a unix timestamp is prepended to the ID so that it can be used for sorting by time as well.
+def makeRequestID():
+    return "%017.4f:%s" % (time.time(), str(uuid.uuid4()))
+
+# this returns the key for logging the messages of the request handled by the current thread (see RequestContext).
+# threads which don't work for a request use a per-process key. 
+# make sure this is called at least once in the main thread before any child thread logs anything.
 __requestID= None
 def getRequestID():
     global __requestID
+    if requestContext.requestID!=None:
+        return requestContext.requestID
     if __requestID==None:
-        __requestID= "%017.4f:%s" % (time.time(), str(uuid.uuid4()))
+        __requestID= makeRequestID()
     return __requestID
 
 debuglevel= 1
-## debug print. only shows on stderr if level >= debuglevel. everything is logged to sqlite file DATADIR/log.db.
-def dprint(level, *args):
+## debug print. only shows on stderr if level <= debuglevel. messages up to config['log-level'] are logged to sqlite file DATADIR/log.db.
+# if args are given, the message is formatted with them only if it is shown or logged, so dprint(3, 'x=%s', x) is cheap when level 3 is off.
+def dprint(level, message, *args):
+    toStderr= debuglevel>=level
+    toDB= config['log-level']>=level
+    if not (toStderr or toDB):
+        return
+    if args:
+        message= message % args
     timestamp= MakeTimestamp()
     
-    logToDB(timestamp, level, getRequestID(), *args)
+    if toDB:
+        logToDB(timestamp, level, getRequestID(), message)
     
-    if(debuglevel>=level):
-        sys.stderr.write('[%s] ' % timestamp)
-        sys.stderr.write(*args)
-        sys.stderr.write("\n")
+    if toStderr:
+        sys.stderr.write('[%s] %s\n' % (timestamp, message))
 
 __WikiToServerMapLock= threading.Lock()
 # get mapping for wikiname => sql server
@@ -284,34 +746,6 @@ def getWikiServerMap():
             __WikiToServerMapLock.release()
     return WikiToServerMap
     
-def CachedThreadValue(name, getValue):
-    t= threading.currentThread()
-    try:
-        t.cache
-    except AttributeError:
-        t.cache= dict()
-    try:
-        return t.cache[name]
-    except KeyError:
-        t.cache[name]= getValue()
-    return t.cache[name]
-
-class DictCache(dict):
-    def __init__(self):
-        dict.__init__(self)
-    def __missing__(self, key):
-        newvalue= self.createEntry(key)
-        self.__setitem__(key, newvalue)
-        return newvalue
-    def createEntry(self, key):
-        raise NotImplementedError("createEntry must be reimplemented in subclasses")
-
-def getConnections():
-    class Connections(DictCache):
-        def createEntry(self, key):
-            return MySQLdb.connect( read_default_file=GetSQLDefaultFile(), host=key, use_unicode=False, cursorclass=MySQLdb.cursors.DictCursor )
-    return CachedThreadValue('SQLConnections', Connections)
-
 if TOOLSERVER and threading.currentThread().name == 'MainThread':
     # precache once in the main thread, not separately for each thread (which would work, but can be slow because of the locking)
     getWikiServerMap()
@@ -326,8 +760,7 @@ except Exception as ex:
 
 
 def logStats(statDict):
-    global testrun
-    if testrun: s= 'testrunstats'
+    if requestContext.testrun: s= 'testrunstats'
     else: s= 'stats'
     dprint(0, '%s: %s' % (s, json.dumps(statDict)))
 
@@ -336,7 +769,7 @@ if __name__ == '__main__':
     dprint(1, "foo")
     dprint(1, "bar")
     dprint(1, "äöü")
-    print getConnections()['sql-s1']
+    print ConnectionPool.acquire('sql-s1').conn
     print getCursors()['dewiki_p']
     print getCursors()
     print getPageByID('dewiki_p', 917280)
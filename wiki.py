@@ -2,9 +2,11 @@
 # -*- coding:utf-8 -*-
 import os
 import socket
-from wikitools import wiki, api
 from utils import *
 
+wiki= LazyModule('wikitools.wiki')
+api= LazyModule('wikitools.api')
+
 class SimpleMW:
     ## constructor.
     # @param lang language ('de', 'en' etc)